@@ -8,6 +8,7 @@ from beartype import beartype
 
 from browser_env import Action, ActionParsingError, Trajectory
 from browser_env.env_config import URL_MAPPINGS
+from browser_env.processors import DELTA_OBSERVATION_MARKER
 from browser_env.utils import StateInfo
 from llms import lm_config
 
@@ -93,6 +94,43 @@ class PromptConstructor(object):
     ) -> APIInput:
         raise NotImplementedError
 
+    @beartype
+    def get_observation(self, state_info: StateInfo) -> str:
+        """Return the observation truncated to `max_obs_length` tokens,
+        observations already serialized under that budget by the environment
+        are used as is"""
+        obs = state_info["observation"][self.obs_modality]
+        max_obs_length = self.lm_config.gen_config["max_obs_length"]
+        if max_obs_length:
+            num_tokens = (
+                state_info["info"]
+                .get("observation_metadata", {})
+                .get(self.obs_modality, {})
+                .get("num_tokens")
+            )
+            if num_tokens is None or num_tokens > max_obs_length:
+                obs = self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
+        return obs  # type: ignore[return-value]
+
+    @beartype
+    def compose_observation(self, trajectory: Trajectory) -> str:
+        """Return the observation of the last state. For prompts of delta
+        observations (`"observation_mode": "delta"`), the changes are
+        preceded by the last full observation and the changes since"""
+        state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
+        obs = self.get_observation(state_info)
+        if self.instruction["meta_data"].get("observation_mode") != "delta":
+            return obs
+
+        observations = [obs]
+        # the states are every other element of the trajectory
+        for state_info in trajectory[-3::-2]:  # type: ignore[assignment]
+            _, _, tree = observations[0].partition("\n\n")
+            if not tree.startswith(DELTA_OBSERVATION_MARKER):
+                break
+            observations.insert(0, self.get_observation(state_info))
+        return "\n\n".join(observations)
+
     @beartype
     def map_url_to_real(self, url: str) -> str:
         """Map the urls to their real world counterparts"""
@@ -145,10 +183,7 @@ class DirectPromptConstructor(PromptConstructor):
         keywords = self.instruction["meta_data"]["keywords"]
         state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
 
-        obs = state_info["observation"][self.obs_modality]
-        max_obs_length = self.lm_config.gen_config["max_obs_length"]
-        if max_obs_length:
-            obs = self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
+        obs = self.compose_observation(trajectory)
 
         page = state_info["info"]["page"]
         url = page.url
@@ -205,10 +240,7 @@ class CoTPromptConstructor(PromptConstructor):
         keywords = self.instruction["meta_data"]["keywords"]
         state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
 
-        obs = state_info["observation"][self.obs_modality]
-        max_obs_length = self.lm_config.gen_config["max_obs_length"]
-        if max_obs_length:
-            obs = self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
+        obs = self.compose_observation(trajectory)
 
         page = state_info["info"]["page"]
         url = page.url
@@ -16,6 +16,7 @@ Page Operation Actions:
 `hover [id]`: Hover over an element with id.
 `press [key_comb]`:  Simulates the pressing of a key combination on the keyboard (e.g., Ctrl+v).
 `scroll [direction=down|up]`: Scroll the page up or down.
+`expand [id]`: Show again the elements below the element with id that were collapsed because they were already shown before.
 
 Tab Management Actions:
 `new_tab`: Open a new, empty browser tab.
@@ -8,6 +8,7 @@ from .actions import (
     action2str,
     create_check_action,
     create_click_action,
+    create_expand_action,
     create_focus_and_click_action,
     create_focus_and_type_action,
     create_go_back_action,
@@ -36,10 +37,12 @@ from .envs import ScriptBrowserEnv
 from .processors import ObservationMetadata
 from .trajectory import Trajectory
 from .utils import DetachedPage, StateInfo
+from .vector_envs import ScriptBrowserVectorEnv
 
 __all__ = [
     "ScriptBrowserEnv",
     "AsyncScriptBrowserEnv",
+    "ScriptBrowserVectorEnv",
     "DetachedPage",
     "StateInfo",
     "ObservationMetadata",
@@ -71,6 +74,7 @@ __all__ = [
     "create_hover_action",
     "create_select_option_action",
     "create_stop_action",
+    "create_expand_action",
     "ActionParsingError",
     "Trajectory",
 ]
@@ -0,0 +1,274 @@
+"""Incremental maintenance of the full accessibility tree of a page.
+
+`Accessibility.getFullAXTree` returns every node of the page on every step,
+even when an action only changed a text box or a hover state. With the
+`Accessibility` domain enabled, the browser reports the nodes it updated
+with `Accessibility.nodesUpdated` and the load of a new document with
+`Accessibility.loadComplete`. `AccessibilityTreeTracker` listens to both
+on the CDP session of the page and patches its copy of the tree, so only
+the changed nodes travel over CDP between two observations.
+
+`StableElementIds` numbers the nodes by their DOM node so that unchanged
+regions serialize identically from one observation to the next.
+
+`AccessibilityTreeIndex` is the indexed view of a node list that the text
+processor shares between bound refinement, viewport culling and parsing.
+"""
+import sys
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+from playwright.sync_api import CDPSession, Error
+
+from .utils import AccessibilityTree, AccessibilityTreeNode
+
+# the role of every node with the same role is the same dict
+_ROLES: dict[str, dict[str, Any]] = {}
+
+
+def compact_accessibility_node(
+    node: AccessibilityTreeNode,
+) -> AccessibilityTreeNode:
+    """Drop the parts of a CDP accessibility node that are never read, the
+    sources of its name, its ignored reasons and its Chrome role, and
+    share its role with the other nodes"""
+    node.pop("ignoredReasons", None)  # type: ignore[misc]
+    node.pop("chromeRole", None)  # type: ignore[misc]
+    role = node.get("role")
+    if role is not None and isinstance(role.get("value"), str):
+        value = role["value"]
+        if value not in _ROLES:
+            _ROLES[value] = {"value": sys.intern(value)}
+        node["role"] = _ROLES[value]
+    name = node.get("name")
+    if name is not None and "value" in name:
+        node["name"] = {"value": name["value"]}
+    return node
+
+
+class AccessibilityTreeTracker:
+    """Keeps the full accessibility tree of one page up to date.
+
+    The tracker does not hold a reference to the CDP session it listens
+    to, so it can be stored in a `weakref.WeakKeyDictionary` keyed by it.
+    """
+
+    def __init__(self, client: CDPSession) -> None:
+        # node id -> node, the root first and parents before their children
+        self.nodes: dict[str, AccessibilityTreeNode] = {}
+        self.url: str | None = None
+        self.stale = True
+        self.pending: list[AccessibilityTreeNode] = []
+        # number of nodes received over CDP by the last `sync`
+        self.num_fetched_nodes = 0
+        client.on("Accessibility.nodesUpdated", self.on_nodes_updated)
+        client.on("Accessibility.loadComplete", self.on_load_complete)
+        # the events are only sent once the domain is enabled, which the
+        # sessions of the tabs opened by an action or by the page are not
+        client.send("Accessibility.enable")
+
+    def on_nodes_updated(self, event: dict[str, Any]) -> None:
+        self.pending.extend(event["nodes"])
+
+    def on_load_complete(self, event: dict[str, Any]) -> None:
+        self.stale = True
+        self.pending.clear()
+
+    def sync(self, client: CDPSession, url: str) -> AccessibilityTree:
+        """Return the current tree of the page at `url`, fetching the full
+        tree after a navigation and patching the updated nodes otherwise"""
+        # a node without parent that we have not seen is a new document
+        replaced = any(
+            node["nodeId"] not in self.nodes and "parentId" not in node
+            for node in self.pending
+        )
+        if self.stale or replaced or url != self.url:
+            self._fetch_full_tree(client, url)
+        elif self.pending:
+            try:
+                self._apply_updates(client)
+            except Error:
+                # a node went away while we were filling in the gaps
+                self._fetch_full_tree(client, url)
+        else:
+            self.num_fetched_nodes = 0
+        return list(self.nodes.values())
+
+    def _fetch_full_tree(self, client: CDPSession, url: str) -> None:
+        self.pending.clear()
+        accessibility_tree: AccessibilityTree = client.send(
+            "Accessibility.getFullAXTree", {}
+        )["nodes"]
+        self.num_fetched_nodes = len(accessibility_tree)
+
+        # a few nodes are repeated in the accessibility tree
+        self.nodes = {}
+        for node in accessibility_tree:
+            if node["nodeId"] not in self.nodes:
+                self.nodes[node["nodeId"]] = compact_accessibility_node(node)
+        self.url = url
+        self.stale = False
+
+    def _apply_updates(self, client: CDPSession) -> None:
+        updates, self.pending = self.pending, []
+        self.num_fetched_nodes = len(updates)
+        root_id = next(iter(self.nodes))
+        for node in updates:
+            self.nodes[node["nodeId"]] = compact_accessibility_node(node)
+
+        # the updated nodes can point to children we have never seen
+        missing = [
+            node["nodeId"]
+            for node in updates
+            if any(c not in self.nodes for c in node.get("childIds", []))
+        ]
+        while missing:
+            parent_id = missing.pop()
+            children = client.send(
+                "Accessibility.getChildAXNodes", {"id": parent_id}
+            )["nodes"]
+            self.num_fetched_nodes += len(children)
+            for child in children:
+                if child["nodeId"] in self.nodes:
+                    continue
+                self.nodes[child["nodeId"]] = compact_accessibility_node(child)
+                if child.get("childIds"):
+                    missing.append(child["nodeId"])
+
+        # drop the nodes that are no longer attached to the tree while
+        # keeping parents before their children
+        reachable: dict[str, AccessibilityTreeNode] = {}
+        stack = [root_id]
+        while stack:
+            node_id = stack.pop()
+            if node_id in reachable or node_id not in self.nodes:
+                continue
+            node = self.nodes[node_id]
+            reachable[node_id] = node
+            stack.extend(reversed(node.get("childIds", [])))
+        self.nodes = reachable
+
+
+class StableElementIds:
+    """Element ids that stay the same across observations of a page.
+
+    CDP assigns new accessibility node ids whenever the tree is rebuilt, so
+    two observations of an unchanged region would still differ in every
+    id. The nodes are instead numbered by their backend DOM node, which
+    lives as long as the DOM node, in the order they are first seen. Nodes
+    without a DOM node, or sharing it with another node, are numbered by
+    their accessibility node id.
+    """
+
+    def __init__(self) -> None:
+        self.ids: dict[int | str, str] = {}
+
+    def assign(self, nodes: AccessibilityTree) -> None:
+        """Set the `elementId` of every node"""
+        ids = self.ids
+        seen = set()
+        for node in nodes:
+            key = node.get("backendDOMNodeId", node["nodeId"])
+            if key in seen:
+                # a second node of the same DOM node
+                key = node["nodeId"]
+            seen.add(key)
+            element_id = ids.get(key)
+            if element_id is None:
+                element_id = ids[key] = str(len(ids) + 1)
+            node["elementId"] = element_id
+
+
+class AccessibilityTreeIndex:
+    """Row lookups over a list of accessibility tree nodes.
+
+    `row` maps a node id and `backend_row` a backend DOM node id to the
+    position of the node in `nodes`. `parent` and `children` hold rows,
+    references to nodes outside of the list are left out. `bounds` and
+    `union_bounds` are (N, 4) arrays of the node bounds, NaN where a node
+    has none, filled from the nodes by `update_bounds`.
+    """
+
+    def __init__(
+        self,
+        nodes: AccessibilityTree,
+        bounds: npt.NDArray[np.float64] | None = None,
+        union_bounds: npt.NDArray[np.float64] | None = None,
+    ) -> None:
+        self.nodes = nodes
+        self.row: dict[str, int] = {}
+        self.backend_row: dict[int, int] = {}
+        for idx, node in enumerate(nodes):
+            self.row[node["nodeId"]] = idx
+            if "backendDOMNodeId" in node:
+                self.backend_row.setdefault(node["backendDOMNodeId"], idx)
+
+        row = self.row
+        self.parent = np.array(
+            [row.get(node.get("parentId", ""), -1) for node in nodes],
+            dtype=np.int64,
+        )
+        self.children = [
+            [row[child_id] for child_id in node["childIds"] if child_id in row]
+            for node in nodes
+        ]
+        # closest ancestor with a union bound, see `ancestor_with_bound`
+        self._bound_ancestor: dict[int, int] = {}
+
+        if bounds is None or union_bounds is None:
+            self.update_bounds()
+        else:
+            self.bounds = bounds
+            self.union_bounds = union_bounds
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def update_bounds(self) -> None:
+        """Refresh the bound arrays from the `bound` and `union_bound` of
+        the nodes"""
+        nan = [np.nan] * 4
+        self.bounds = np.array(
+            [node.get("bound") or nan for node in self.nodes],
+            dtype=np.float64,
+        ).reshape(-1, 4)
+        self.union_bounds = np.array(
+            [node.get("union_bound") or nan for node in self.nodes],
+            dtype=np.float64,
+        ).reshape(-1, 4)
+
+    def ancestor_with_bound(self, idx: int) -> int:
+        """Return the row of the closest ancestor of row `idx` that has a
+        union bound, the top-most ancestor when none has one and -1 for a
+        node without parent.
+
+        Every chain of ancestors is only walked once, the answer of every
+        row on the way is memoized.
+        """
+        memo = self._bound_ancestor
+        nodes = self.nodes
+        path = []
+        cur = idx
+        while cur not in memo:
+            parent = int(self.parent[cur])
+            if parent < 0:
+                memo[cur] = -1
+            elif nodes[parent].get("union_bound") is not None:
+                memo[cur] = parent
+            else:
+                path.append(cur)
+                cur = parent
+        for cur in reversed(path):
+            parent = int(self.parent[cur])
+            memo[cur] = memo[parent] if memo[parent] >= 0 else parent
+        return memo[idx]
+
+    def select(self, mask: npt.NDArray[np.bool_]) -> "AccessibilityTreeIndex":
+        """Return the index of the nodes where `mask` is set"""
+        rows = np.flatnonzero(mask)
+        return AccessibilityTreeIndex(
+            [self.nodes[i] for i in rows.tolist()],
+            self.bounds[rows],
+            self.union_bounds[rows],
+        )
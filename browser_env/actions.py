@@ -149,6 +149,8 @@ def action2str(
                 action_str = f"page_focus [{action['page_number']}]"
             case ActionTypes.STOP:
                 action_str = f"stop [{action['answer']}]"
+            case ActionTypes.EXPAND:
+                action_str = f"expand [{element_id}]"
             case ActionTypes.NONE:
                 action_str = "none"
             case _:
@@ -234,6 +236,8 @@ def action2create_function(action: Action) -> str:
             return f"create_select_option_action(pw_code={repr(action['pw_code'])})"
         case ActionTypes.STOP:
             return f'create_stop_action({repr(action["answer"])})'
+        case ActionTypes.EXPAND:
+            return f"create_expand_action({repr(action['element_id'])})"
 
     raise ValueError(f"Invalid action type: {action['action_type']}")
 
@@ -270,6 +274,9 @@ class ActionTypes(IntEnum):
 
     STOP = 17
 
+    # show a subtree collapsed by the text observation in full
+    EXPAND = 18
+
     def __str__(self) -> str:
         return f"ACTION_TYPES.{self.name}"
 
@@ -320,6 +327,8 @@ def is_equivalent(a: Action, b: Action) -> bool:
             return a["pw_code"] == b["pw_code"]
         case ActionTypes.STOP:
             return a["answer"] == b["answer"]
+        case ActionTypes.EXPAND:
+            return a["element_id"] == b["element_id"]
         case _:
             raise ValueError(f"Unknown action type: {a['action_type']}")
 
@@ -452,6 +461,15 @@ def create_stop_action(answer: str) -> Action:
     return action
 
 
+@beartype
+def create_expand_action(element_id: str) -> Action:
+    action = create_none_action()
+    action.update(
+        {"action_type": ActionTypes.EXPAND, "element_id": element_id}
+    )
+    return action
+
+
 @beartype
 def create_scroll_action(direction: str) -> Action:
     """Return the playwright action"""
@@ -1245,6 +1263,9 @@ def execute_action(
                 raise NotImplementedError(
                     "No proper locator found for select option action"
                 )
+        case ActionTypes.EXPAND:
+            # only changes the next observation, the page is left as is
+            obseration_processor.expand(action["element_id"])  # type: ignore[attr-defined]
 
         case _:
             raise ValueError(f"Unknown action type: {action_type}")
@@ -1254,7 +1275,10 @@ def execute_action(
 
 @beartype
 async def aexecute_action(
-    action: Action, page: APage, browser_ctx: ABrowserContext
+    action: Action,
+    page: APage,
+    browser_ctx: ABrowserContext,
+    obseration_processor: ObservationProcessor | None = None,
 ) -> APage:
     """Execute the async action on the ChromeDriver."""
     action_type = action["action_type"]
@@ -1283,7 +1307,11 @@ async def aexecute_action(
             # check each kind of locator in order
             # TODO[shuyanzh]: order is temp now
             if action["element_id"]:
-                raise NotImplementedError
+                element_id = action["element_id"]
+                element_center = obseration_processor.get_element_center(element_id)  # type: ignore[union-attr]
+                await aexecute_mouse_click(
+                    element_center[0], element_center[1], page
+                )
             elif action["element_role"] and action["element_name"]:
                 element_role = int(action["element_role"])
                 element_name = action["element_name"]
@@ -1301,7 +1329,11 @@ async def aexecute_action(
                 raise ValueError("No proper locator found for click action")
         case ActionTypes.HOVER:
             if action["element_id"]:
-                raise NotImplementedError
+                element_id = action["element_id"]
+                element_center = obseration_processor.get_element_center(element_id)  # type: ignore[union-attr]
+                await aexecute_mouse_hover(
+                    element_center[0], element_center[1], page
+                )
             elif action["element_role"] and action["element_name"]:
                 element_role = int(action["element_role"])
                 element_name = action["element_name"]
@@ -1320,7 +1352,12 @@ async def aexecute_action(
                 )
         case ActionTypes.TYPE:
             if action["element_id"]:
-                raise NotImplementedError
+                element_id = action["element_id"]
+                element_center = obseration_processor.get_element_center(element_id)  # type: ignore[union-attr]
+                await aexecute_mouse_click(
+                    element_center[0], element_center[1], page
+                )
+                await aexecute_type(action["text"], page)
             elif action["element_role"] and action["element_name"]:
                 element_role = int(action["element_role"])
                 element_name = action["element_name"]
@@ -1344,6 +1381,7 @@ async def aexecute_action(
             page = browser_ctx.pages[action["page_number"]]
             await page.bring_to_front()
         case ActionTypes.NEW_TAB:
+            # the env opens its CDP session, with the domains it needs
             page = await browser_ctx.new_page()
         case ActionTypes.GO_BACK:
             await page.go_back()
@@ -1376,6 +1414,9 @@ async def aexecute_action(
                 raise NotImplementedError(
                     "No proper locator found for select option action"
                 )
+        case ActionTypes.EXPAND:
+            # only changes the next observation, the page is left as is
+            obseration_processor.expand(action["element_id"])  # type: ignore[union-attr]
 
         case _:
             raise ValueError(f"Unknown action type: {action_type}")
@@ -1599,6 +1640,11 @@ def create_id_based_action(action_str: str) -> Action:
             return create_page_focus_action(page_number)
         case "close_tab":
             return create_page_close_action()
+        case "expand":
+            match = re.search(r"expand ?\[(\d+)\]", action_str)
+            if not match:
+                raise ActionParsingError(f"Invalid expand action {action_str}")
+            return create_expand_action(match.group(1))
         case "stop":  # stop answer
             match = re.search(r"stop ?\[(.+)\]", action_str)
             if not match:  # some tasks don't require an answer
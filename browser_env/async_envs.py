@@ -1,26 +1,57 @@
 import asyncio
 import json
-from dataclasses import dataclass
 from pathlib import Path
+from typing import Any
 
-import numpy as np
-import numpy.typing as npt
+import tiktoken
 from beartype import beartype
 from gymnasium import Env
-from gymnasium.spaces import Box, Text
-from playwright.async_api import Page, ViewportSize, async_playwright
+from playwright.async_api import (
+    Browser,
+    CDPSession,
+    Error,
+    Page,
+    PlaywrightContextManager,
+    ViewportSize,
+    async_playwright,
+)
 
 from .actions import Action, aexecute_action, get_action_space
-from .utils import DetachedPage, png_bytes_to_numpy
+from .constants import RESOURCE_BLOCKING_PROFILES
+from .envs import blocked_request_command, blocked_request_patterns
+from .page_scripts import DOM_VERSION_SCRIPT
+from .processors import AsyncObservationHandler, ObservationMetadata
+from .utils import DetachedPage, Observation
 
 
-class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
+async def ablock_resources(page: Page, profile: dict[str, str]) -> None:
+    """Async `block_resources`"""
+    session = await page.context.new_cdp_session(page)
+
+    async def answer(event: dict[str, Any]) -> None:
+        try:
+            await session.send(*blocked_request_command(event, profile))
+        except Error:
+            pass  # the page was closed meanwhile
+
+    session.on("Fetch.requestPaused", answer)
+    await session.send(
+        "Fetch.enable", {"patterns": blocked_request_patterns(profile)}
+    )
+
+
+class AsyncScriptBrowserEnv(Env[dict[str, Observation], Action]):
     """
     The goal of this environment is to produce a prototype of a browser environment.
     In the end, we want to support a fully configurable browser environment with wide
     range of action spaces and observation spaces, both structured and unstructured.
     But in this prototype, we just support action space specified by Playwright script,
     and observation space is the html content of the page.
+
+    The observations and the actions are the same as in `ScriptBrowserEnv`,
+    so that many envs can share one event loop. The incremental
+    accessibility tree is not supported, the screenshot is always taken
+    and the html of the page in the step info is always serialized.
     """
 
     @beartype
@@ -30,29 +61,105 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
         headless: bool = True,
         slow_mo: int = 0,
         timeout: int = 30000,
+        observation_type: str = "html",
+        current_viewport_only: bool = False,
         viewport_size: ViewportSize = {"width": 1280, "height": 720},
+        save_trace_enabled: bool = False,
+        sleep_after_execution: float = 0.0,
+        max_obs_length: int = 0,
+        tokenizer: tiktoken.core.Encoding | None = None,
+        text_observation_backend: str = "cdp",
+        observation_workers: int = 0,
+        resource_blocking: str = "none",
+        extra_text_observation_types: list[str] = [],
+        stable_element_ids: bool = False,
+        delta_keyframe_interval: int = 0,
+        collapse_repeated_subtrees: bool = False,
     ):
-        self.observation_space = Box(
-            0,
-            255,
-            (viewport_size["height"], viewport_size["width"], 4),
-            np.uint8,
-        )
         # TODO: make Space[Action] = ActionSpace
         self.action_space = get_action_space()  # type: ignore[assignment]
         self.headless = headless
         self.slow_mo = slow_mo
+        self.current_viewport_only = current_viewport_only
         self.reset_finished = False
         self.timeout = timeout
+        # the driver and the browser are kept across resets, every task
+        # gets its own context
+        self.context_manager: PlaywrightContextManager | None = None
+        self.browser: Browser | None = None
         self.viewport_size = viewport_size
+        self.save_trace_enabled = save_trace_enabled
+        self.sleep_after_execution = sleep_after_execution
+        if resource_blocking not in RESOURCE_BLOCKING_PROFILES:
+            raise ValueError(
+                f"Invalid resource blocking profile: {resource_blocking}"
+            )
+        if resource_blocking != "none" and observation_type == "image":
+            raise ValueError(
+                "Resource blocking is only supported for text observations"
+            )
+        self.resource_blocking = resource_blocking
+
+        match observation_type:
+            case "html" | "accessibility_tree":
+                self.text_observation_type = observation_type
+                self.image_observation_type = ""
+                self.main_observation_type = "text"
+            case "image" if extra_text_observation_types:
+                raise ValueError(
+                    "Extra text observations need a text observation type"
+                )
+            case "image":
+                self.image_observation_type = observation_type
+                self.text_observation_type = ""  # type: ignore[assignment]
+                self.main_observation_type = "image"
+            case _:
+                raise ValueError(
+                    f"Unsupported observation type: {observation_type}"
+                )
+
+        self.observation_handler = AsyncObservationHandler(
+            self.main_observation_type,
+            self.text_observation_type,
+            self.image_observation_type,
+            self.current_viewport_only,
+            self.viewport_size,
+            max_obs_length=max_obs_length,
+            tokenizer=tokenizer,
+            image_observation_mode="eager",
+            text_observation_backend=text_observation_backend,
+            observation_workers=observation_workers,
+            extra_text_observation_types=extra_text_observation_types,
+            stable_element_ids=stable_element_ids,
+            delta_keyframe_interval=delta_keyframe_interval,
+            collapse_repeated_subtrees=collapse_repeated_subtrees,
+        )
+        self.text_observation_types = [
+            self.text_observation_type,
+            *self.observation_handler.text_processor.extra_observation_types,
+        ]
+
+        self.observation_space = (
+            self.observation_handler.get_observation_space()
+        )
+
+    @beartype
+    async def launch_browser(self) -> Browser:
+        """Start the Playwright driver and Chromium once, or again after
+        the browser went away"""
+        if self.context_manager is None:
+            self.context_manager = async_playwright()
+            self.playwright = await self.context_manager.__aenter__()
+        if self.browser is None or not self.browser.is_connected():
+            self.browser = await self.playwright.chromium.launch(
+                headless=self.headless, slow_mo=self.slow_mo
+            )
+        return self.browser
 
     @beartype
     async def setup(self, config_file: Path | None = None) -> None:
-        self.context_manager = async_playwright()
-        self.playwright = await self.context_manager.__aenter__()
-        self.browser = await self.playwright.chromium.launch(
-            headless=self.headless, slow_mo=self.slow_mo
-        )
+        browser = await self.launch_browser()
+
         if config_file:
             with open(config_file, "r") as f:
                 instance_config = json.load(f)
@@ -63,15 +170,52 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
         start_url = instance_config.get("start_url", None)
         geolocation = instance_config.get("geolocation", None)
 
-        self.context = await self.browser.new_context(
+        self.context = await browser.new_context(
             viewport=self.viewport_size,
             storage_state=storage_state,
             geolocation=geolocation,
             device_scale_factor=1,
         )
-        self.page = await self.context.new_page()
-        if start_url:
-            await self.page.goto(start_url)
+        # lets the text processor tell a scroll from a DOM change
+        await self.context.add_init_script(script=DOM_VERSION_SCRIPT)
+        profile = RESOURCE_BLOCKING_PROFILES[self.resource_blocking]
+        if profile:
+            # also covers the tabs and the popups opened later
+            self.context.on(
+                "page", lambda page: ablock_resources(page, profile)
+            )
+        if self.save_trace_enabled:
+            await self.context.tracing.start(screenshots=True, snapshots=True)
+        start_urls = start_url.split(" |AND| ") if start_url else [None]
+        for url in start_urls:
+            page = await self.context.new_page()
+            await self.get_page_client(page)
+            if url is not None:
+                await page.goto(url)
+        # set the first page as the current page
+        self.page = self.context.pages[0]
+        await self.page.bring_to_front()
+
+    @beartype
+    async def get_page_client(self, page: Page) -> CDPSession:
+        """The CDP session of `page`, opened on first use, e.g. for a page
+        opened by a link"""
+        if not hasattr(page, "client"):
+            client = await page.context.new_cdp_session(page)
+            if "accessibility_tree" in self.text_observation_types:
+                await client.send("Accessibility.enable")
+            page.client = client  # type: ignore[attr-defined]
+        return page.client  # type: ignore[attr-defined]
+
+    @beartype
+    async def _aget_obs(self) -> dict[str, Observation]:
+        return await self.observation_handler.aget_observation(
+            self.page, await self.get_page_client(self.page)
+        )
+
+    @beartype
+    def _get_obs_metadata(self) -> dict[str, ObservationMetadata]:
+        return self.observation_handler.get_observation_metadata()
 
     @beartype
     async def areset(
@@ -79,15 +223,18 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
         *,
         seed: int | None = None,
         options: dict[str, str] | None = None,
-    ) -> tuple[npt.NDArray[np.uint8], dict[str, object]]:
+    ) -> tuple[dict[str, Observation], dict[str, Any]]:
         """
         Reset the environment.
         :param options: options for the environment. The options are:
             - storage_state: the path to the storage state file
         """
         super().reset(seed=seed, options=options)
+        self.observation_handler.reset()
         if self.reset_finished:
-            await self.context_manager.__aexit__()
+            # the storage, the cache and the trace of the last task go away
+            # with its context
+            await self.aclose_context()
         if options is not None and "config_file" in options:
             config_file = Path(options["config_file"])
             if config_file.exists():
@@ -97,12 +244,17 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
         else:
             await self.setup()
         self.reset_finished = True
-        content = await self.page.content()
-        screenshot = png_bytes_to_numpy(await self.page.screenshot())
-        return (
-            screenshot,
-            {"page": DetachedPage(self.page.url, content)},
-        )
+
+        if self.sleep_after_execution > 0:
+            await asyncio.sleep(self.sleep_after_execution)
+
+        observation = await self._aget_obs()
+        info = {
+            "page": DetachedPage(self.page.url, ""),
+            "fail_error": "",
+            "observation_metadata": self._get_obs_metadata(),
+        }
+        return (observation, info)
 
     @beartype
     def reset(
@@ -110,12 +262,29 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
         *,
         seed: int | None = None,
         options: dict[str, str] | None = None,
-    ) -> tuple[npt.NDArray[np.uint8], dict[str, object]]:
+    ) -> tuple[dict[str, Observation], dict[str, Any]]:
         return asyncio.run(self.areset(seed=seed, options=options))
 
+    @beartype
+    async def asave_trace(self, trace_path: str | Path) -> None:
+        if self.save_trace_enabled:
+            await self.context.tracing.stop(path=trace_path)
+
+    async def aclose_context(self) -> None:
+        if self.browser is not None and self.browser.is_connected():
+            await self.context.close()
+
     async def aclose(self) -> None:
+        self.observation_handler.close()
         if self.reset_finished:
+            await self.aclose_context()
+            self.reset_finished = False
+        if self.context_manager is not None:
+            if self.browser is not None and self.browser.is_connected():
+                await self.browser.close()
             await self.context_manager.__aexit__()
+            self.context_manager = None
+            self.browser = None
 
     def close(self) -> None:
         asyncio.run(self.aclose())
@@ -123,38 +292,47 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
     @beartype
     async def astep(
         self, action: Action
-    ) -> tuple[npt.NDArray[np.uint8], float, bool, bool, dict[str, object]]:
+    ) -> tuple[dict[str, Observation], float, bool, bool, dict[str, Any]]:
         if not self.reset_finished:
             raise RuntimeError("Call reset first before calling step.")
         success = False
         fail_error = ""
         try:
-            self.page = await aexecute_action(action, self.page, self.context)
+            self.page = await aexecute_action(
+                action,
+                self.page,
+                self.context,
+                self.observation_handler.action_processor,
+            )
             success = True
         except Exception as e:
             fail_error = str(e)
 
+        # hard sleep TODO[shuyanzh] suboptimal, may need to check network
+        if self.sleep_after_execution > 0:
+            await asyncio.sleep(self.sleep_after_execution)
+
+        observation = await self._aget_obs()
         try:
             content = await self.page.content()
-            screenshot = png_bytes_to_numpy(await self.page.screenshot())
         except:
             await self.page.wait_for_load_state("load")
             content = await self.page.content()
-            screenshot = png_bytes_to_numpy(await self.page.screenshot())
 
         return (
-            screenshot,
+            observation,
             float(success),
             False,
             False,
             {
                 "page": DetachedPage(self.page.url, content),
                 "fail_error": fail_error,
+                "observation_metadata": self._get_obs_metadata(),
             },
         )
 
     @beartype
     def step(
         self, action: Action
-    ) -> tuple[npt.NDArray[np.uint8], float, bool, bool, dict[str, object]]:
+    ) -> tuple[dict[str, Observation], float, bool, bool, dict[str, Any]]:
         return asyncio.run(self.astep(action), debug=True)
@@ -293,3 +293,35 @@ IGNORED_ACTREE_PROPERTIES = (
     "multiline",
     "invalid",
 )
+
+# resource type -> "abort" or "stub" for the requests that a text-only
+# observation never needs, stylesheets and scripts are always loaded so the
+# layout and the accessibility tree are unchanged apart from the sizes of
+# images without explicit dimensions
+RESOURCE_BLOCKING_PROFILES: dict[str, dict[str, str]] = {
+    "none": {},
+    # images are answered with a blank pixel so their load handlers still
+    # run, e.g. for lazy loaded galleries
+    "text": {"image": "stub", "media": "abort", "font": "abort"},
+    "text_strict": {
+        "image": "abort",
+        "media": "abort",
+        "font": "abort",
+        "texttrack": "abort",
+        "manifest": "abort",
+    },
+}
+# the CDP names of the resource types of `RESOURCE_BLOCKING_PROFILES`
+CDP_RESOURCE_TYPES = {
+    "image": "Image",
+    "media": "Media",
+    "font": "Font",
+    "texttrack": "TextTrack",
+    "manifest": "Manifest",
+}
+# 1x1 transparent GIF
+BLANK_IMAGE = (
+    b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04"
+    b"\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D"
+    b"\x01\x00;"
+)
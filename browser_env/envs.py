@@ -1,26 +1,38 @@
+import base64
 import json
 import re
 import time
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Union
+from typing import Any, Literal, Union
 
 import numpy as np
 import numpy.typing as npt
+import tiktoken
 from beartype import beartype
 from gymnasium import Env
 from gymnasium.spaces import Box, Text
 from playwright.sync_api import (
+    Browser,
+    BrowserContext,
     CDPSession,
+    Error,
     Page,
     Playwright,
+    PlaywrightContextManager,
     ViewportSize,
     expect,
     sync_playwright,
 )
 
 from .actions import Action, execute_action, get_action_space
+from .constants import (
+    BLANK_IMAGE,
+    CDP_RESOURCE_TYPES,
+    RESOURCE_BLOCKING_PROFILES,
+)
+from .page_scripts import DOM_VERSION_SCRIPT
 from .processors import ObservationHandler, ObservationMetadata
 from .utils import (
     AccessibilityTree,
@@ -39,6 +51,64 @@ class PlaywrightScript:
     value: str | None = None  # avatar movie, Enter
 
 
+@dataclass
+class PrefetchedContext:
+    config_mtime_ns: int  # the config file the context was opened for
+    context: BrowserContext
+
+
+def blocked_request_patterns(profile: dict[str, str]) -> list[dict[str, str]]:
+    """The `Fetch.enable` patterns that pause the requests of the resource
+    types blocked by a profile of `RESOURCE_BLOCKING_PROFILES`, the other
+    requests are never paused"""
+    return [
+        {"urlPattern": "*", "resourceType": CDP_RESOURCE_TYPES[resource_type]}
+        for resource_type in profile
+    ]
+
+
+def blocked_request_command(
+    event: dict[str, Any], profile: dict[str, str]
+) -> tuple[str, dict[str, Any]]:
+    """The CDP command that aborts or stubs the request of a
+    `Fetch.requestPaused` event"""
+    request_id = event["requestId"]
+    if profile.get(event["resourceType"].lower()) == "stub":
+        return "Fetch.fulfillRequest", {
+            "requestId": request_id,
+            "responseCode": 200,
+            "responseHeaders": [
+                {"name": "Content-Type", "value": "image/gif"}
+            ],
+            "body": base64.b64encode(BLANK_IMAGE).decode(),
+        }
+    return "Fetch.failRequest", {
+        "requestId": request_id,
+        "errorReason": "BlockedByClient",
+    }
+
+
+def block_resources(page: Page, profile: dict[str, str]) -> None:
+    """Block the resource types of `profile` on `page` in the browser.
+
+    Only the blocked requests wait for an answer from Python, the
+    documents, stylesheets and scripts load without any round trip, also
+    while no Playwright call is in flight.
+    """
+    session = page.context.new_cdp_session(page)
+
+    def answer(event: dict[str, Any]) -> None:
+        try:
+            session.send(*blocked_request_command(event, profile))
+        except Error:
+            pass  # the page was closed meanwhile
+
+    session.on("Fetch.requestPaused", answer)
+    session.send(
+        "Fetch.enable", {"patterns": blocked_request_patterns(profile)}
+    )
+
+
 @beartype
 def parse_action(action: str) -> PlaywrightScript:
     splitted = action.strip().split(" ")
@@ -84,6 +154,20 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         viewport_size: ViewportSize = {"width": 1280, "height": 720},
         save_trace_enabled: bool = False,
         sleep_after_execution: float = 0.0,
+        max_obs_length: int = 0,
+        tokenizer: tiktoken.core.Encoding | None = None,
+        incremental_accessibility_tree: bool = False,
+        image_observation_mode: str = "auto",
+        text_observation_backend: str = "cdp",
+        observation_workers: int = 0,
+        page_content_mode: str = "lazy",
+        resource_blocking: str = "none",
+        extra_text_observation_types: list[str] = [],
+        stable_element_ids: bool = False,
+        delta_keyframe_interval: int = 0,
+        collapse_repeated_subtrees: bool = False,
+        prefetch_contexts: int = 0,
+        prefetch_memory_limit_mb: int = 0,
     ):
         # TODO: make Space[Action] = ActionSpace
         self.action_space = get_action_space()  # type: ignore[assignment]
@@ -91,15 +175,46 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         self.slow_mo = slow_mo
         self.current_viewport_only = current_viewport_only
         self.reset_finished = False
+        # the driver and the browser are kept across resets, every task
+        # gets its own context
+        self.context_manager: PlaywrightContextManager | None = None
+        self.browser: Browser | None = None
         self.viewport_size = viewport_size
         self.save_trace_enabled = save_trace_enabled
         self.sleep_after_execution = sleep_after_execution
+        # "lazy" only serializes the html of info["page"] when it is read
+        if page_content_mode not in ("lazy", "eager"):
+            raise ValueError(f"Invalid page content mode: {page_content_mode}")
+        self.page_content_mode = page_content_mode
+        self.detached_page: DetachedPage | None = None
+        # requests that text observations never need, see
+        # `RESOURCE_BLOCKING_PROFILES`
+        if resource_blocking not in RESOURCE_BLOCKING_PROFILES:
+            raise ValueError(
+                f"Invalid resource blocking profile: {resource_blocking}"
+            )
+        if resource_blocking != "none" and observation_type == "image":
+            raise ValueError(
+                "Resource blocking is only supported for text observations"
+            )
+        self.resource_blocking = resource_blocking
+        # contexts opened ahead of their task, by resolved config file path
+        # in the order they were asked for, see `prefetch`
+        if prefetch_contexts < 0 or prefetch_memory_limit_mb < 0:
+            raise ValueError("The prefetch limits can not be negative")
+        self.prefetch_contexts = prefetch_contexts
+        self.prefetch_memory_limit_mb = prefetch_memory_limit_mb
+        self.prefetched: OrderedDict[str, PrefetchedContext] = OrderedDict()
 
         match observation_type:
             case "html" | "accessibility_tree":
                 self.text_observation_type = observation_type
                 self.image_observation_type = ""
                 self.main_observation_type = "text"
+            case "image" if extra_text_observation_types:
+                raise ValueError(
+                    "Extra text observations need a text observation type"
+                )
             case "image":
                 self.image_observation_type = observation_type
                 self.text_observation_type = ""  # type: ignore[assignment]
@@ -115,19 +230,50 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             self.image_observation_type,
             self.current_viewport_only,
             self.viewport_size,
+            max_obs_length=max_obs_length,
+            tokenizer=tokenizer,
+            incremental_accessibility_tree=incremental_accessibility_tree,
+            image_observation_mode=image_observation_mode,
+            text_observation_backend=text_observation_backend,
+            observation_workers=observation_workers,
+            extra_text_observation_types=extra_text_observation_types,
+            stable_element_ids=stable_element_ids,
+            delta_keyframe_interval=delta_keyframe_interval,
+            collapse_repeated_subtrees=collapse_repeated_subtrees,
         )
+        self.text_observation_types = [
+            self.text_observation_type,
+            *self.observation_handler.text_processor.extra_observation_types,
+        ]
 
         self.observation_space = (
             self.observation_handler.get_observation_space()
         )
 
     @beartype
-    def setup(self, config_file: Path | None = None) -> None:
-        self.context_manager = sync_playwright()
-        self.playwright = self.context_manager.__enter__()
-        self.browser = self.playwright.chromium.launch(
-            headless=self.headless, slow_mo=self.slow_mo
-        )
+    def launch_browser(self) -> Browser:
+        """Start the Playwright driver and Chromium once, or again after
+        the browser went away"""
+        if self.context_manager is None:
+            self.context_manager = sync_playwright()
+            self.playwright = self.context_manager.__enter__()
+        if self.browser is None or not self.browser.is_connected():
+            # the prefetched contexts went away with the old browser
+            self.prefetched.clear()
+            self.browser = self.playwright.chromium.launch(
+                headless=self.headless, slow_mo=self.slow_mo
+            )
+        return self.browser
+
+    @beartype
+    def new_context(
+        self,
+        config_file: Path | None,
+        wait_until: Literal["commit", "domcontentloaded", "load"] = "load",
+    ) -> BrowserContext:
+        """Open the context of a task with its start pages, the navigations
+        only wait until `wait_until`"""
+        browser = self.launch_browser()
 
         if config_file:
             with open(config_file, "r") as f:
@@ -139,34 +285,122 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         start_url = instance_config.get("start_url", None)
         geolocation = instance_config.get("geolocation", None)
 
-        self.context = self.browser.new_context(
+        context = browser.new_context(
             viewport=self.viewport_size,
             storage_state=storage_state,
             geolocation=geolocation,
             device_scale_factor=1,
         )
+        # lets the text processor tell a scroll from a DOM change
+        context.add_init_script(script=DOM_VERSION_SCRIPT)
+        profile = RESOURCE_BLOCKING_PROFILES[self.resource_blocking]
+        if profile:
+            # also covers the tabs and the popups opened later
+            context.on("page", lambda page: block_resources(page, profile))
         if self.save_trace_enabled:
-            self.context.tracing.start(screenshots=True, snapshots=True)
-        if start_url:
-            start_urls = start_url.split(" |AND| ")
-            for url in start_urls:
-                page = self.context.new_page()
-                client = page.context.new_cdp_session(
-                    page
-                )  # talk to chrome devtools
-                if self.text_observation_type == "accessibility_tree":
-                    client.send("Accessibility.enable")
-                page.client = client  # type: ignore # TODO[shuyanzh], fix this hackey client
-                page.goto(url)
-            # set the first page as the current page
-            self.page = self.context.pages[0]
-            self.page.bring_to_front()
-        else:
-            self.page = self.context.new_page()
-            client = self.page.context.new_cdp_session(self.page)
-            if self.text_observation_type == "accessibility_tree":
+            context.tracing.start(screenshots=True, snapshots=True)
+        start_urls = start_url.split(" |AND| ") if start_url else [None]
+        for url in start_urls:
+            page = context.new_page()
+            client = page.context.new_cdp_session(
+                page
+            )  # talk to chrome devtools
+            if "accessibility_tree" in self.text_observation_types:
                 client.send("Accessibility.enable")
-            self.page.client = client  # type: ignore
+            page.client = client  # type: ignore # TODO[shuyanzh], fix this hackey client
+            if url is not None:
+                page.goto(url, wait_until=wait_until)
+        return context
+
+    @beartype
+    def setup(self, config_file: Path | None = None) -> None:
+        context = self.take_prefetched_context(config_file)
+        if context is None:
+            self.context = self.new_context(config_file)
+        else:
+            # the start pages were loading while the last task ran
+            self.context = context
+            for page in self.context.pages:
+                page.wait_for_load_state("load")
+        # set the first page as the current page
+        self.page = self.context.pages[0]
+        self.page.bring_to_front()
+
+    @beartype
+    def prefetch(self, config_file: Path | str) -> None:
+        """Open the context of an upcoming task so that its `reset` does
+        not wait for the start pages.
+
+        The navigations are only started, the pages load in the browser
+        while the current task runs. The pool keeps at most
+        `prefetch_contexts` contexts and, with `prefetch_memory_limit_mb`,
+        at most that much JavaScript heap over their pages, the oldest
+        contexts are closed first.
+        """
+        if self.prefetch_contexts == 0:
+            return
+        config_file = Path(config_file)
+        key = str(config_file.resolve())
+        mtime_ns = config_file.stat().st_mtime_ns
+        entry = self.prefetched.get(key)
+        if entry is not None and entry.config_mtime_ns == mtime_ns:
+            return
+        self.discard_prefetched(key)
+        try:
+            context = self.new_context(config_file, wait_until="commit")
+        except Error:
+            # the task reports the error when it opens its own context
+            return
+        self.prefetched[key] = PrefetchedContext(mtime_ns, context)
+
+        while len(self.prefetched) > self.prefetch_contexts or (
+            self.prefetch_memory_limit_mb > 0
+            and self.prefetched_memory_mb() > self.prefetch_memory_limit_mb
+        ):
+            self.discard_prefetched(next(iter(self.prefetched)))
+
+    @beartype
+    def take_prefetched_context(
+        self, config_file: Path | None
+    ) -> BrowserContext | None:
+        """Hand over the prefetched context of `config_file`, the contexts
+        prefetched for the tasks before it are stale and closed"""
+        if config_file is None or not self.prefetched:
+            return None
+        key = str(config_file.resolve())
+        if key not in self.prefetched:
+            return None
+        # the run order changed, the skipped tasks will not come
+        for stale_key in list(self.prefetched):
+            if stale_key == key:
+                break
+            self.discard_prefetched(stale_key)
+        entry = self.prefetched.pop(key)
+        if entry.config_mtime_ns != config_file.stat().st_mtime_ns:
+            entry.context.close()
+            return None
+        return entry.context
+
+    def discard_prefetched(self, key: str) -> None:
+        entry = self.prefetched.pop(key, None)
+        if entry is not None and self.browser is not None:
+            if self.browser.is_connected():
+                entry.context.close()
+
+    def prefetched_memory_mb(self) -> float:
+        """The JavaScript heap used by the pages of the prefetched
+        contexts"""
+        used = 0
+        for entry in self.prefetched.values():
+            for page in entry.context.pages:
+                try:
+                    used += self.get_page_client(page).send(
+                        "Runtime.getHeapUsage"
+                    )["usedSize"]
+                except Error:
+                    # the page is still between two documents
+                    continue
+        return used / 2**20
 
     @beartype
     def get_page_client(self, page: Page) -> CDPSession:
@@ -184,6 +418,19 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         metadata = self.observation_handler.get_observation_metadata()
         return metadata
 
+    def detach_page(self) -> DetachedPage:
+        if self.page_content_mode == "eager":
+            return DetachedPage(self.page.url, self.page.content())
+        self.detached_page = DetachedPage(self.page.url, self.page.content)
+        return self.detached_page
+
+    def expire_detached_page(self) -> None:
+        """Called before the page changes, the content of the last step can
+        no longer be captured"""
+        if self.detached_page is not None:
+            self.detached_page.expire()
+            self.detached_page = None
+
     @beartype
     def reset(
         self,
@@ -197,8 +444,12 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             - "storage_state": the storage state of the browser. It is a file path to a json file.
         """
         super().reset(seed=seed, options=options)
+        self.observation_handler.reset()
+        self.expire_detached_page()
         if self.reset_finished:
-            self.context_manager.__exit__()
+            # the storage, the cache and the trace of the last task go away
+            # with its context
+            self.close_context()
 
         if options is not None and "config_file" in options:
             config_file = Path(options["config_file"])
@@ -230,8 +481,22 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
 
     @beartype
     def close(self) -> None:
+        self.observation_handler.close()
+        for key in list(self.prefetched):
+            self.discard_prefetched(key)
         if self.reset_finished:
+            self.close_context()
+            self.reset_finished = False
+        if self.context_manager is not None:
+            if self.browser is not None and self.browser.is_connected():
+                self.browser.close()
             self.context_manager.__exit__()
+            self.context_manager = None
+            self.browser = None
+
+    def close_context(self) -> None:
+        if self.browser is not None and self.browser.is_connected():
+            self.context.close()
 
     def step(
         self, action: Action
@@ -241,6 +506,8 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
 
         success = False
         fail_error = ""
+        self.observation_handler.expire_observation()
+        self.expire_detached_page()
         try:
             self.page = execute_action(
                 action,
@@ -256,11 +523,17 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         if self.sleep_after_execution > 0:
             time.sleep(self.sleep_after_execution)
 
-        observation = self._get_obs()
+        # an eager page content is fetched while the observation is
+        # serialized
+        finish_observation = self.observation_handler.submit_observation(
+            self.page, self.get_page_client(self.page)
+        )
+        page = self.detach_page()
+        observation = finish_observation()
         observation_metadata = self._get_obs_metadata()
 
         info = {
-            "page": DetachedPage(self.page.url, self.page.content()),
+            "page": page,
             "fail_error": fail_error,
             "observation_metadata": observation_metadata,
         }
@@ -0,0 +1,391 @@
+"""JavaScript snippets evaluated inside the pages"""
+
+# Installed with `BrowserContext.add_init_script`. It keeps a counter that is
+# bumped whenever something that can change the rendered page happens, except
+# for scrolling the document itself. Together with `performance.timeOrigin`,
+# which is unique per document, it tells whether a page is still showing the
+# same DOM as in the previous observation.
+DOM_VERSION_SCRIPT = """
+(() => {
+    if (window.__webarenaDomVersion !== undefined) {
+        return;
+    }
+    window.__webarenaDomVersion = 0;
+    const bump = () => {
+        window.__webarenaDomVersion += 1;
+    };
+    new MutationObserver(bump).observe(document, {
+        subtree: true,
+        childList: true,
+        attributes: true,
+        characterData: true,
+    });
+    for (const type of [
+        "input",
+        "change",
+        "focusin",
+        "focusout",
+        "mouseover",
+        "mouseout",
+        "resize",
+        "load",
+        "transitionend",
+        "animationend",
+    ]) {
+        window.addEventListener(type, bump, true);
+    }
+    // the load of an image, an iframe or a stylesheet, or its failure,
+    // moves the layout, these events do not reach the window
+    for (const type of ["load", "error"]) {
+        document.addEventListener(type, bump, true);
+    }
+    // as does a web font
+    document.fonts.addEventListener("loadingdone", bump);
+    // scrolling an inner container moves its content
+    window.addEventListener(
+        "scroll",
+        (event) => {
+            if (event.target !== document) {
+                bump();
+            }
+        },
+        true
+    );
+})();
+"""
+
+# `null` on pages where the init script is not installed
+DOM_VERSION_JS = (
+    "window.__webarenaDomVersion === undefined ? null"
+    " : `${performance.timeOrigin}:${window.__webarenaDomVersion}`"
+)
+
+# everything `TextObervationProcessor.fetch_browser_info` needs from the page
+# in a single round trip
+BROWSER_INFO_JS = f"""
+() => ({{
+    pageYOffset: window.pageYOffset,
+    pageXOffset: window.pageXOffset,
+    screenWidth: window.screen.width,
+    screenHeight: window.screen.height,
+    devicePixelRatio: window.devicePixelRatio,
+    domVersion: {DOM_VERSION_JS},
+}})
+"""
+
+# The "page_script" backend of `TextObervationProcessor`. It builds an
+# approximation of the accessibility tree from the DOM and the ARIA
+# attributes inside the page, computes the bounds in document coordinates
+# like `DOMSnapshot.captureSnapshot`, and drops the nodes that
+# `parse_accessibility_tree` would skip, so that only the compact node list
+# crosses the Playwright pipe. A node is
+# [id, role, name, properties, child ids, bound, union bound], the id is the
+# position of the node unless stableElementIds is set.
+ACCESSIBILITY_TREE_JS = f"""
+({{ currentViewportOnly, prunedRoles, stableElementIds }}) => {{
+    const scrollX = window.pageXOffset;
+    const scrollY = window.pageYOffset;
+    const win = {{
+        pageYOffset: scrollY,
+        pageXOffset: scrollX,
+        screenWidth: window.screen.width,
+        screenHeight: window.screen.height,
+        devicePixelRatio: window.devicePixelRatio,
+        domVersion: {DOM_VERSION_JS},
+    }};
+    const right = scrollX + win.screenWidth;
+    const lower = scrollY + win.screenHeight;
+    const pruned = new Set(prunedRoles);
+    const skippedTags = new Set([
+        "SCRIPT", "STYLE", "NOSCRIPT", "TEMPLATE", "HEAD", "META", "LINK",
+    ]);
+    const nameFromContent = new Set([
+        "link", "button", "heading", "cell", "gridcell", "columnheader",
+        "rowheader", "option", "menuitem", "menuitemcheckbox",
+        "menuitemradio", "tab", "treeitem", "switch", "tooltip",
+    ]);
+    const textFields = new Set(["textbox", "searchbox", "combobox", "spinbutton"]);
+    const formControls = new Set([
+        "textbox", "searchbox", "combobox", "listbox", "spinbutton",
+        "checkbox", "radio",
+    ]);
+
+    const clean = (s) => (s || "").replace(/\\s+/g, " ").trim();
+    const toBound = (rect) => [
+        rect.x + scrollX, rect.y + scrollY, rect.width, rect.height,
+    ];
+    const isValid = (b) => Math.abs(b[2]) > 1e-8 && Math.abs(b[3]) > 1e-8;
+    const unite = (a, b) => {{
+        if (a === null) return b;
+        if (b === null) return a;
+        const x0 = Math.min(a[0], b[0]);
+        const y0 = Math.min(a[1], b[1]);
+        const x1 = Math.max(a[0] + a[2], b[0] + b[2]);
+        const y1 = Math.max(a[1] + a[3], b[1] + b[3]);
+        return [x0, y0, x1 - x0, y1 - y0];
+    }};
+    const inViewport = (b) =>
+        b !== null &&
+        b[0] < right && b[0] + b[2] >= scrollX &&
+        b[1] < lower && b[1] + b[3] >= scrollY;
+
+    const implicitRole = (el) => {{
+        switch (el.tagName) {{
+            case "A":
+            case "AREA":
+                return el.hasAttribute("href") ? "link" : "generic";
+            case "BUTTON":
+                return "button";
+            case "INPUT": {{
+                const type = (el.getAttribute("type") || "text").toLowerCase();
+                if (type === "hidden") return null;
+                if (["button", "submit", "reset", "image"].includes(type)) return "button";
+                if (type === "checkbox" || type === "radio") return type;
+                if (type === "range") return "slider";
+                if (type === "number") return "spinbutton";
+                if (type === "search") return "searchbox";
+                return el.hasAttribute("list") ? "combobox" : "textbox";
+            }}
+            case "TEXTAREA":
+                return "textbox";
+            case "SELECT":
+                return el.multiple || el.size > 1 ? "listbox" : "combobox";
+            case "OPTION":
+                return "option";
+            case "IMG":
+                return el.getAttribute("alt") === "" ? null : "img";
+            case "H1": case "H2": case "H3": case "H4": case "H5": case "H6":
+                return "heading";
+            case "UL": case "OL": case "MENU":
+                return "list";
+            case "LI":
+                return "listitem";
+            case "NAV":
+                return "navigation";
+            case "MAIN":
+                return "main";
+            case "HEADER":
+                return "banner";
+            case "FOOTER":
+                return "contentinfo";
+            case "ASIDE":
+                return "complementary";
+            case "FORM":
+                return "form";
+            case "SECTION":
+                return "Section";
+            case "TABLE":
+                return "table";
+            case "TR":
+                return "row";
+            case "TD":
+                return "cell";
+            case "TH":
+                return "columnheader";
+            case "P":
+                return "paragraph";
+            case "LABEL":
+                return "LabelText";
+            case "LEGEND":
+                return "Legend";
+            case "STRONG":
+                return "strong";
+            case "DIALOG":
+                return "dialog";
+            case "HR":
+                return "separator";
+            default:
+                return "generic";
+        }}
+    }};
+
+    const accessibleName = (el, role) => {{
+        const labelledBy = el.getAttribute("aria-labelledby");
+        if (labelledBy) {{
+            const name = clean(
+                labelledBy
+                    .split(/\\s+/)
+                    .map((id) => document.getElementById(id))
+                    .filter((label) => label !== null)
+                    .map((label) => label.textContent)
+                    .join(" ")
+            );
+            if (name) return name;
+        }}
+        const label = clean(el.getAttribute("aria-label"));
+        if (label) return label;
+        if (el.labels && el.labels.length) {{
+            const name = clean(
+                Array.from(el.labels).map((l) => l.textContent).join(" ")
+            );
+            if (name) return name;
+        }}
+        if (el.tagName === "IMG" || el.tagName === "AREA") {{
+            const alt = clean(el.getAttribute("alt"));
+            if (alt) return alt;
+        }}
+        if (el.tagName === "INPUT" && role === "button") {{
+            const value = clean(el.value);
+            if (value) return value;
+            if (el.type === "submit") return "Submit";
+            if (el.type === "reset") return "Reset";
+        }}
+        if (nameFromContent.has(role)) {{
+            const name = clean(el.textContent);
+            if (name) return name;
+        }}
+        return clean(el.getAttribute("title") || el.getAttribute("placeholder"));
+    }};
+
+    const properties = (el, role) => {{
+        const props = {{}};
+        if (el === document.activeElement && el !== document.body) {{
+            props.focused = true;
+        }}
+        if (formControls.has(role) && "required" in el) {{
+            props.required = el.required;
+        }}
+        if (role === "checkbox" || role === "radio" || role === "switch") {{
+            props.checked = el.getAttribute("aria-checked") ?? String(!!el.checked);
+        }}
+        if (el.disabled || el.getAttribute("aria-disabled") === "true") {{
+            props.disabled = true;
+        }}
+        const expanded = el.getAttribute("aria-expanded");
+        if (expanded !== null) props.expanded = expanded === "true";
+        if (el.selected || el.getAttribute("aria-selected") === "true") {{
+            props.selected = true;
+        }}
+        const hasPopup = el.getAttribute("aria-haspopup");
+        if (hasPopup && hasPopup !== "false") {{
+            props.hasPopup = hasPopup === "true" ? "menu" : hasPopup;
+        }}
+        return props;
+    }};
+
+    // with stableElementIds, a node keeps its id as long as its DOM node
+    // lives, the value of a text field is keyed by the field
+    if (stableElementIds && window.__webarenaElementIds === undefined) {{
+        window.__webarenaElementIds = new WeakMap();
+        window.__webarenaValueIds = new WeakMap();
+        window.__webarenaNextElementId = 1;
+    }}
+    const idOf = (node) => {{
+        const ids = node.isValue
+            ? window.__webarenaValueIds
+            : window.__webarenaElementIds;
+        let id = ids.get(node.source);
+        if (id === undefined) {{
+            id = window.__webarenaNextElementId++;
+            ids.set(node.source, id);
+        }}
+        return id;
+    }};
+
+    const textNode = (name, bound, source, isValue = false) => ({{
+        role: "StaticText",
+        name,
+        props: {{}},
+        children: [],
+        bound,
+        union: isValid(bound) ? bound : null,
+        source,
+        isValue,
+    }});
+
+    // returns the nodes that take the place of `domNode` in its parent
+    const visit = (domNode, visible) => {{
+        if (domNode.nodeType === Node.TEXT_NODE) {{
+            const name = clean(domNode.data);
+            if (!name || !visible) return [];
+            const range = document.createRange();
+            range.selectNodeContents(domNode);
+            return [
+                textNode(name, toBound(range.getBoundingClientRect()), domNode),
+            ];
+        }}
+        if (domNode.nodeType !== Node.ELEMENT_NODE) return [];
+        const el = domNode;
+        if (
+            skippedTags.has(el.tagName) ||
+            el.hidden ||
+            el.getAttribute("aria-hidden") === "true"
+        ) {{
+            return [];
+        }}
+        const style = window.getComputedStyle(el);
+        if (style.display === "none") return [];
+        visible = style.visibility !== "hidden" && style.visibility !== "collapse";
+
+        let childNodes = el.shadowRoot ? el.shadowRoot.childNodes : el.childNodes;
+        if (el.tagName === "SLOT" && el.assignedNodes({{ flatten: true }}).length) {{
+            childNodes = el.assignedNodes({{ flatten: true }});
+        }}
+        const children = [];
+        for (const child of childNodes) {{
+            children.push(...visit(child, visible));
+        }}
+
+        let role = el.getAttribute("role");
+        role = role ? role.trim().split(/\\s+/)[0] : implicitRole(el);
+        if (role === "presentation" || role === "none" || !visible) {{
+            role = null;
+        }}
+        if (role === null) return children;
+
+        const name = accessibleName(el, role);
+        const props = properties(el, role);
+        if (
+            !name &&
+            ((pruned.has(role) && !Object.keys(props).length) ||
+                role === "listitem")
+        ) {{
+            return children;
+        }}
+
+        const bound = toBound(el.getBoundingClientRect());
+        if (textFields.has(role) && "value" in el && clean(el.value)) {{
+            children.unshift(textNode(clean(el.value), bound, el, true));
+        }}
+        let union = isValid(bound) ? bound : null;
+        for (const child of children) {{
+            union = unite(union, child.union);
+        }}
+        return [{{ role, name, props, children, bound, union, source: el }}];
+    }};
+
+    const rootBound = [
+        0, 0,
+        document.documentElement.scrollWidth,
+        document.documentElement.scrollHeight,
+    ];
+    const root = {{
+        role: "RootWebArea",
+        name: clean(document.title),
+        props: {{}},
+        children: visit(document.documentElement, true),
+        bound: rootBound,
+        union: rootBound,
+        source: document,
+    }};
+    for (const child of root.children) {{
+        root.union = unite(root.union, child.union);
+    }}
+
+    const nodes = [];
+    const serialize = (node) => {{
+        const id = stableElementIds ? idOf(node) : nodes.length;
+        const entry = [
+            id, node.role, node.name, node.props, [], node.bound, node.union,
+        ];
+        nodes.push(entry);
+        for (const child of node.children) {{
+            if (currentViewportOnly && !inViewport(child.union)) continue;
+            entry[4].push(serialize(child));
+        }}
+        return entry[0];
+    }};
+    serialize(root);
+    return {{ window: win, nodes }};
+}}
+"""
@@ -1,14 +1,20 @@
+import asyncio
 import json
+import multiprocessing
 import re
 import traceback
-from collections import defaultdict
-from dataclasses import dataclass
-from typing import Any, TypedDict, Union
+import weakref
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Coroutine, Iterator, TypedDict, Union
 
 import numpy as np
 import numpy.typing as npt
+import tiktoken
 from beartype import beartype
 from gymnasium import spaces
+from playwright.async_api import CDPSession as ACDPSession
+from playwright.async_api import Page as APage
 from playwright.sync_api import CDPSession, Page, ViewportSize
 
 from browser_env.constants import (
@@ -18,6 +24,14 @@ from browser_env.constants import (
     UTTERANCE_MAX_LENGTH,
 )
 
+from .accessibility import (
+    AccessibilityTreeIndex,
+    AccessibilityTreeTracker,
+    StableElementIds,
+    compact_accessibility_node,
+)
+from .page_scripts import ACCESSIBILITY_TREE_JS, BROWSER_INFO_JS
+from .snapshot import DOMSnapshotArrays, decode_dom_snapshot
 from .utils import (
     AccessibilityTree,
     BrowserConfig,
@@ -26,70 +40,337 @@ from .utils import (
     png_bytes_to_numpy,
 )
 
+SNAPSHOT_COMPUTED_STYLES = ["position"]
+# nodes with these roles are skipped when they have no name and no property
+EMPTY_NODE_ROLES = [
+    "generic",
+    "img",
+    "list",
+    "strong",
+    "paragraph",
+    "banner",
+    "navigation",
+    "Section",
+    "LabelText",
+    "Legend",
+    "listitem",
+]
+STATIC_TEXT_PATTERN = re.compile(r"\[\d+\] StaticText '([^']+)'")
+ELEMENT_ID_PATTERN = re.compile(r"\s*\[(\w+)\]")
+# first line of a delta observation, see `diff_accessibility_trees`
+DELTA_OBSERVATION_MARKER = "CHANGES SINCE THE PREVIOUS OBSERVATION:"
+# smallest subtree, in lines, that `collapse_repeated_subtrees` collapses
+MIN_COLLAPSED_SUBTREE_LINES = 8
+
+
+def run_concurrently(
+    page: Page,
+    coros: list[Coroutine[Any, Any, Any]],
+    return_exceptions: bool = False,
+) -> list[Any]:
+    """Await the coroutines of playwright implementation objects together on
+    the event loop behind the sync API of `page`, so that their CDP and
+    evaluate messages share one round trip instead of one each"""
+
+    async def gather() -> list[Any]:
+        return await asyncio.gather(
+            *coros, return_exceptions=return_exceptions
+        )
+
+    return page._sync(gather())  # type: ignore[attr-defined]
+
 
 class ObservationProcessor:
     def process(self, page: Page, client: CDPSession) -> Observation:
         raise NotImplementedError
 
 
+class ObsNodeInfo:
+    """What the metadata keeps about a node shown in the observation. A
+    trajectory keeps one per node and step, so it is a slotted record that
+    still reads like the dict it replaces, e.g. `info["text"]`."""
+
+    __slots__ = (
+        "backend_id",
+        "bound",
+        "union_bound",
+        "offsetrect_bound",
+        "text",
+    )
+
+    def __init__(
+        self,
+        backend_id: int,
+        bound: list[float] | None,
+        union_bound: list[float] | None,
+        offsetrect_bound: list[float] | None,
+        text: str,
+    ) -> None:
+        self.backend_id = backend_id
+        self.bound = bound
+        self.union_bound = union_bound
+        self.offsetrect_bound = offsetrect_bound
+        self.text = text
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.__slots__
+
+    def keys(self) -> tuple[str, ...]:
+        return self.__slots__
+
+    def as_dict(self) -> dict[str, Any]:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, ObsNodeInfo):
+            return self.as_dict() == other.as_dict()
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"ObsNodeInfo({self.as_dict()})"
+
+    def __getstate__(self) -> dict[str, Any]:
+        return self.as_dict()
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        for key, value in state.items():
+            setattr(self, key, value)
+
+
 class ObservationMetadata(TypedDict):
     obs_nodes_info: dict[str, Any]
+    # number of tokens when the observation is serialized under a token budget
+    num_tokens: int | None
 
 
 def create_empty_metadata() -> ObservationMetadata:
     return {
         "obs_nodes_info": {},
+        "num_tokens": None,
     }
 
 
+class TokenBudget:
+    """Running token count of an observation that is serialized piece by
+    piece, so that it can stop once `max_tokens` is reached instead of being
+    tokenized and truncated as a whole afterwards"""
+
+    def __init__(
+        self, tokenizer: tiktoken.core.Encoding, max_tokens: int
+    ) -> None:
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.used = 0
+
+    @property
+    def exhausted(self) -> bool:
+        return self.used >= self.max_tokens
+
+    def consume(self, text: str) -> str:
+        """Count `text` against the budget and return the part that fits"""
+        tokens = self.tokenizer.encode(text)
+        remaining = max(self.max_tokens - self.used, 0)
+        if len(tokens) <= remaining:
+            self.used += len(tokens)
+            return text
+        self.used = self.max_tokens
+        return self.tokenizer.decode(tokens[:remaining])
+
+
+@dataclass
+class PageObservationCache:
+    """The last full capture of a page, decoded. While the DOM version of
+    the page does not change, a scroll is answered from here."""
+
+    url: str
+    dom_version: str | None
+    scroll: tuple[float, float]  # window offsets at capture time
+    snapshot: DOMSnapshotArrays
+    reusable: bool
+    accessibility_tree: AccessibilityTree | None = None
+    reused: bool = False  # a scroll was answered from this capture
+
+
+@dataclass
+class TextObservationMemo:
+    """The last text observation, returned again while the fingerprint of
+    the page does not change"""
+
+    fingerprint: tuple[Any, ...]
+    content: str
+    obs_nodes_info: dict[str, Any]
+    num_tokens: int | None
+    browser_config: BrowserConfig
+    extra: dict[str, str] = field(default_factory=dict)
+    hits: int = 0
+
+
 class TextObervationProcessor(ObservationProcessor):
     def __init__(
         self,
         observation_type: str,
         current_viewport_only: bool,
         viewport_size: ViewportSize,
+        max_obs_length: int = 0,
+        tokenizer: tiktoken.core.Encoding | None = None,
+        incremental_accessibility_tree: bool = False,
+        backend: str = "cdp",
+        observation_workers: int = 0,
+        extra_observation_types: list[str] = [],
+        stable_element_ids: bool = False,
+        delta_keyframe_interval: int = 0,
+        collapse_repeated_subtrees: bool = False,
     ):
+        # "cdp" builds the observation from DOMSnapshot and the full
+        # accessibility tree, "page_script" from ACCESSIBILITY_TREE_JS
+        if backend not in ("cdp", "page_script"):
+            raise ValueError(f"Invalid text observation backend: {backend}")
+        if (
+            backend == "page_script"
+            and observation_type != "accessibility_tree"
+        ):
+            raise ValueError(
+                "The page_script backend only supports accessibility_tree observations"
+            )
+        # other representations built from the same browser fetches
+        for extra_type in extra_observation_types:
+            if extra_type not in ("html", "accessibility_tree"):
+                raise ValueError(
+                    f"Invalid extra observation type: {extra_type}"
+                )
+        if backend == "page_script" and extra_observation_types:
+            raise ValueError(
+                "The page_script backend does not support extra observation types"
+            )
+        self.extra_observation_types = [
+            extra_type
+            for extra_type in dict.fromkeys(extra_observation_types)
+            if extra_type != observation_type
+        ]
+        # observation type -> text of the extra representations
+        self.extra_observations: dict[str, str] = {}
+        self.backend = backend
         self.observation_type = observation_type
         self.current_viewport_only = current_viewport_only
         self.viewport_size = viewport_size
+        # when both are set, stop serializing once max_obs_length is reached
+        self.max_obs_length = max_obs_length
+        self.tokenizer = tokenizer
+        # the last full page capture of each page, keyed by its CDP session
+        self.page_cache: weakref.WeakKeyDictionary[
+            CDPSession, PageObservationCache
+        ] = weakref.WeakKeyDictionary()
+        # patch the accessibility tree with the CDP update events instead
+        # of fetching the full tree on every step
+        self.incremental_accessibility_tree = incremental_accessibility_tree
+        self.accessibility_trackers: weakref.WeakKeyDictionary[
+            CDPSession, AccessibilityTreeTracker
+        ] = weakref.WeakKeyDictionary()
+        self.observation_memo: TextObservationMemo | None = None
+        # number the nodes by their DOM node instead of the CDP node ids,
+        # which change whenever the tree is rebuilt
+        self.stable_element_ids = stable_element_ids
+        self.element_ids: weakref.WeakKeyDictionary[
+            CDPSession, StableElementIds
+        ] = weakref.WeakKeyDictionary()
+        # when set, only the changes since the previous observation are
+        # returned, with the full tree every `delta_keyframe_interval` steps
+        if delta_keyframe_interval and (
+            observation_type != "accessibility_tree" or not stable_element_ids
+        ):
+            raise ValueError(
+                "Delta observations need accessibility_tree observations with stable element ids"
+            )
+        self.delta_keyframe_interval = delta_keyframe_interval
+        # element id -> line of the previous observation
+        self.delta_base: dict[str, str] | None = None
+        self.observations_since_keyframe = 0
+        # when set, subtrees already shown in full this episode, e.g. the
+        # menus repeated on every page of a site, are collapsed into one
+        # line until they are expanded with the expand action
+        if collapse_repeated_subtrees and (
+            observation_type != "accessibility_tree"
+            or not stable_element_ids
+            or delta_keyframe_interval
+        ):
+            raise ValueError(
+                "Collapsing repeated subtrees needs accessibility_tree observations with stable element ids and no delta observations"
+            )
+        self.collapse_repeated_subtrees = collapse_repeated_subtrees
+        # hash of the subtrees shown in full -> url of the page they were
+        # first shown on
+        self.shown_subtrees: dict[int, str] = {}
+        # element ids whose subtree is shown in full in the next observation
+        self.expanded_subtrees: set[str] = set()
+        # serialize the observations in a process pool of this size. The
+        # pool only pays off when something else runs meanwhile: the html
+        # or the screenshot of an eager step, or the other envs of
+        # `ScriptBrowserVectorEnv` and `AsyncScriptBrowserEnv`. With the
+        # lazy defaults of `ScriptBrowserEnv` it only adds the IPC.
+        self.observation_workers = observation_workers
+        self.executor: ProcessPoolExecutor | None = None
         self.observation_tag = "text"
         self.meta_data = (
             create_empty_metadata()
         )  # use the store meta data of this observation type
 
+    @beartype
+    def fetch_window_info(
+        self, page: Page
+    ) -> tuple[dict[str, Any], list[str] | None]:
+        """Return the result of BROWSER_INFO_JS and the titles of the open
+        tabs, None if one of them could not be read, in one round"""
+        open_tabs = page.context.pages
+        window, *tab_titles = run_concurrently(
+            page,
+            [page._impl_obj.evaluate(BROWSER_INFO_JS)]  # type: ignore[attr-defined]
+            + [tab._impl_obj.title() for tab in open_tabs],  # type: ignore[attr-defined]
+            return_exceptions=True,
+        )
+        if isinstance(window, BaseException):
+            raise window
+        if any(isinstance(title, BaseException) for title in tab_titles):
+            return window, None
+        return window, tab_titles
+
     @beartype
     def fetch_browser_info(
         self,
         page: Page,
         client: CDPSession,
+        window: dict[str, Any] | None = None,
+        tab_titles: list[str] | None = None,
     ) -> BrowserInfo:
-        # extract domtree
-        tree = client.send(
-            "DOMSnapshot.captureSnapshot",
-            {
-                "computedStyles": [],
-                "includeDOMRects": True,
-                "includePaintOrder": True,
-            },
-        )
-
-        # calibrate the bounds, in some cases, the bounds are scaled somehow
-        bounds = tree["documents"][0]["layout"]["bounds"]
-        b = bounds[0]
-        n = b[2] / self.viewport_size["width"]
-        bounds = [[x / n for x in bound] for bound in bounds]
-        tree["documents"][0]["layout"]["bounds"] = bounds
-        # add union bound placeholder
-        tree["documents"][0]["layout"]["unionBounds"] = [None for _ in bounds]
-
-        # extract browser info
-        win_upper_bound = page.evaluate("window.pageYOffset")
-        win_left_bound = page.evaluate("window.pageXOffset")
-        win_width = page.evaluate("window.screen.width")
-        win_height = page.evaluate("window.screen.height")
+        # extract browser info and the tab titles
+        if window is None:
+            window, tab_titles = self.fetch_window_info(page)
+        info = self.cached_browser_info(page.url, client, window, tab_titles)
+        if info is None:
+            # extract domtree, together with the accessibility tree
+            tree, *responses = run_concurrently(
+                page,
+                self.capture_commands(client._impl_obj),  # type: ignore[attr-defined]
+            )
+            info = self.store_capture(
+                page.url, client, window, tab_titles, tree, responses
+            )
+        return info
+
+    @staticmethod
+    def window_config(window: dict[str, Any]) -> BrowserConfig:
+        """Return the browser config of the result of BROWSER_INFO_JS"""
+        win_upper_bound = window["pageYOffset"]
+        win_left_bound = window["pageXOffset"]
+        win_width = window["screenWidth"]
+        win_height = window["screenHeight"]
         win_right_bound = win_left_bound + win_width
         win_lower_bound = win_upper_bound + win_height
-        device_pixel_ratio = page.evaluate("window.devicePixelRatio")
+        device_pixel_ratio = window["devicePixelRatio"]
         assert device_pixel_ratio == 1.0, "devicePixelRatio is not 1.0"
 
         config: BrowserConfig = {
@@ -101,9 +382,101 @@ class TextObervationProcessor(ObservationProcessor):
             "win_lower_bound": win_lower_bound,
             "device_pixel_ratio": device_pixel_ratio,
         }
+        return config
+
+    def cached_browser_info(
+        self,
+        url: str,
+        client: Any,
+        window: dict[str, Any],
+        tab_titles: list[str] | None,
+    ) -> BrowserInfo | None:
+        """Return the browser info of the cached capture of the page when
+        only the window moved since, None when the page has to be captured
+        again"""
+        config = self.window_config(window)
+        dom_version = window["domVersion"]
+        cache = self.page_cache.get(client)
+        if not (
+            self.current_viewport_only
+            and cache is not None
+            and cache.reusable
+            and dom_version is not None
+            and cache.dom_version == dom_version
+            and cache.url == url
+        ):
+            return None
+
+        # only the window moved, re-cull the cached page
+        snapshot = cache.snapshot.scrolled(
+            config["win_left_bound"] - cache.scroll[0],
+            config["win_upper_bound"] - cache.scroll[1],
+        )
+        cache.reused = True
+        info: BrowserInfo = {
+            "snapshot": snapshot,
+            "config": config,
+            "tab_titles": tab_titles,
+        }
+        return info
+
+    def capture_commands(
+        self, client: Any
+    ) -> list[Coroutine[Any, Any, dict[str, Any]]]:
+        """Return the CDP commands that capture the page, `client` is a CDP
+        session whose `send` is a coroutine function"""
+        commands = [
+            client.send(
+                "DOMSnapshot.captureSnapshot",
+                {
+                    "computedStyles": SNAPSHOT_COMPUTED_STYLES,
+                    "includeDOMRects": True,
+                    "includePaintOrder": True,
+                },
+            )
+        ]
+        if (
+            self.observation_type == "accessibility_tree"
+            and not self.incremental_accessibility_tree
+        ):
+            commands.append(client.send("Accessibility.getFullAXTree", {}))
+        return commands
+
+    def store_capture(
+        self,
+        url: str,
+        client: Any,
+        window: dict[str, Any],
+        tab_titles: list[str] | None,
+        tree: dict[str, Any],
+        responses: list[dict[str, Any]],
+    ) -> BrowserInfo:
+        """Decode and cache the answers of `capture_commands`"""
+        config = self.window_config(window)
+        # calibrate the bounds and build the node -> layout row lookup
+        snapshot = decode_dom_snapshot(
+            tree, self.viewport_size["width"], SNAPSHOT_COMPUTED_STYLES
+        )
+        self.page_cache[client] = PageObservationCache(
+            url=url,
+            dom_version=window["domVersion"],
+            scroll=(config["win_left_bound"], config["win_upper_bound"]),
+            snapshot=snapshot,
+            # sticky elements move depending on the scroll position
+            reusable=not snapshot.style_mask("position", "sticky").any(),
+            accessibility_tree=self.dedupe_accessibility_tree(
+                responses[0]["nodes"]
+            )
+            if responses
+            else None,
+        )
 
         # assert len(tree['documents']) == 1, "More than one document in the DOM tree"
-        info: BrowserInfo = {"DOMTree": tree, "config": config}
+        info: BrowserInfo = {
+            "snapshot": snapshot,
+            "config": config,
+            "tab_titles": tab_titles,
+        }
 
         return info
 
@@ -127,106 +500,43 @@ class TextObervationProcessor(ObservationProcessor):
 
         return ok
 
+    @staticmethod
+    def in_viewport_mask(
+        bounds: npt.NDArray[np.float64], config: BrowserConfig
+    ) -> npt.NDArray[np.bool_]:
+        """Vectorized `partially_in_viewport` over an (N, 4) array of
+        [x, y, width, height] bounds, rows with NaN are never in the viewport
+        """
+        x, y, width, height = bounds.T
+        return (
+            (x < config["win_right_bound"])
+            & (x + width >= config["win_left_bound"])
+            & (y < config["win_lower_bound"])
+            & (y + height >= config["win_upper_bound"])
+        )
+
     @beartype
-    def retrieve_viewport_info(self, info: BrowserInfo) -> None:
-        """Add viewport related information to the DOMTree
+    @staticmethod
+    def retrieve_viewport_info(info: BrowserInfo) -> None:
+        """Add viewport related information to the snapshot
         1. add union bound, which is a union of all the bounds of the nodes in the subtree
-        This is only used when current_viewport_only is enabled since it is quite slow
-
-        TODO[robert1003]: improve
+        This is only used when current_viewport_only is enabled
         """
-        tree = info["DOMTree"]
-        document = tree["documents"][0]
-        nodes = document["nodes"]
-        parent = nodes["parentIndex"]
-        node_names = nodes["nodeName"]
-
-        layout = document["layout"]
-        layout_node_cursor = layout["nodeIndex"]
-        bounds = layout["bounds"]
-
-        graph = defaultdict(lambda: [])
-        assert len(node_names) == len(parent)
-        for node_idx in range(len(node_names)):
-            parent_idx = parent[node_idx]
-            if parent_idx != -1:
-                graph[parent_idx].append(node_idx)
-
-        union_bounds: list[list[float] | None] = [None for _ in bounds]
-
-        def valid_bbox(bound: list[float] | None) -> bool:
-            if bound is None:
-                return False
-            # no width or height
-            if np.isclose(bound[2], 0):
-                return False
-            if np.isclose(bound[3], 0):
-                return False
-            return True
-
-        def add_union_bound(idx: int) -> list[float] | None:
-            if idx in layout_node_cursor:
-                cursor = layout_node_cursor.index(idx)
-                node_bound = bounds[cursor].copy()
-                tree_bounds: list[Any] = [node_bound]
-                for child_idx in graph[idx]:
-                    child_bound = add_union_bound(child_idx)
-                    tree_bounds.append(
-                        child_bound.copy() if child_bound else None
-                    )
-
-                tree_bounds = [b for b in tree_bounds if valid_bbox(b)]
-                # convert to absolute coordinates
-                for i in range(len(tree_bounds)):
-                    tree_bounds[i][2] = tree_bounds[i][0] + tree_bounds[i][2]
-                    tree_bounds[i][3] = tree_bounds[i][1] + tree_bounds[i][3]
-
-                if len(tree_bounds) == 0:
-                    assert not valid_bbox(node_bound)
-                    node_union_bound = [0.0, 0.0, 0.0, 0.0]
-                else:
-                    left_bound = min([b[0] for b in tree_bounds])
-                    top_bound = min([b[1] for b in tree_bounds])
-                    right_bound = max([b[2] for b in tree_bounds])
-                    bottom_bound = max([b[3] for b in tree_bounds])
-                    node_union_bound = [
-                        left_bound,
-                        top_bound,
-                        right_bound - left_bound,
-                        bottom_bound - top_bound,
-                    ]
-
-                # update the list
-                union_bounds[cursor] = node_union_bound
-            else:
-                node_union_bound = None
-
-            return node_union_bound
-
-        add_union_bound(0)
-        info["DOMTree"]["documents"][0]["layout"]["unionBounds"] = union_bounds
+        info["snapshot"].compute_union_bounds()
 
     @beartype
-    def current_viewport_html(self, info: BrowserInfo) -> str:
+    @staticmethod
+    def current_viewport_html(info: BrowserInfo) -> str:
         # adopted from [natbot](https://github.com/nat/natbot)
-        tree = info["DOMTree"]
-        strings = tree["strings"]
-        document = tree["documents"][0]
-        nodes = document["nodes"]
-        attributes = nodes["attributes"]
-        node_value = nodes["nodeValue"]
-        parent = nodes["parentIndex"]
-        node_names = nodes["nodeName"]
-
-        layout = document["layout"]
-        layout_node_cursor = layout["nodeIndex"]
-        union_bounds = layout["unionBounds"]
-
-        graph = defaultdict(lambda: [])
-        for node_idx in range(len(node_names)):
-            parent_idx = parent[node_idx]
-            if parent_idx != -1:
-                graph[parent_idx].append(node_idx)
+        snapshot = info["snapshot"]
+        strings = snapshot.strings
+        attributes = snapshot.attributes
+        node_value = snapshot.node_value
+        node_names = snapshot.node_name
+        node_to_layout = snapshot.node_to_layout
+        in_viewport = TextObervationProcessor.in_viewport_mask(
+            snapshot.union_bounds, info["config"]
+        )
 
         def dfs(idx: int) -> str:
             node_name = strings[node_names[idx]].lower().strip()
@@ -254,13 +564,10 @@ class TextObervationProcessor(ObservationProcessor):
             else:
                 html += f"{inner_text}"
 
-            for child_idx in graph[idx]:
-                if child_idx in layout_node_cursor:
-                    cursor = layout_node_cursor.index(child_idx)
-                    union_bound = union_bounds[cursor]
-                    if not self.partially_in_viewport(
-                        union_bound, info["config"]
-                    ):
+            for child_idx in snapshot.children(idx):
+                cursor = node_to_layout[child_idx]
+                if cursor >= 0:
+                    if not in_viewport[cursor]:
                         continue
                     html += dfs(child_idx)
 
@@ -272,63 +579,82 @@ class TextObervationProcessor(ObservationProcessor):
         html = dfs(0)
         return html
 
-    @beartype
-    def fetch_page_accessibility_tree(
-        self, info: BrowserInfo, client: CDPSession
+    @staticmethod
+    def dedupe_accessibility_tree(
+        accessibility_tree: AccessibilityTree,
     ) -> AccessibilityTree:
-        accessibility_tree: AccessibilityTree = client.send(
-            "Accessibility.getFullAXTree", {}
-        )["nodes"]
-
         # a few nodes are repeated in the accessibility tree
         seen_ids = set()
         _accessibility_tree = []
         for node in accessibility_tree:
             if node["nodeId"] not in seen_ids:
-                _accessibility_tree.append(node)
+                _accessibility_tree.append(compact_accessibility_node(node))
                 seen_ids.add(node["nodeId"])
-        accessibility_tree = _accessibility_tree
+        return _accessibility_tree
+
+    @beartype
+    def fetch_page_accessibility_tree(
+        self, info: BrowserInfo, client: CDPSession
+    ) -> AccessibilityTree:
+        cache = self.page_cache.get(client)
+        if cache is not None and cache.accessibility_tree is not None:
+            # fetched along with the snapshot, or reused after a scroll
+            accessibility_tree = cache.accessibility_tree
+        elif cache is not None and self.incremental_accessibility_tree:
+            if client not in self.accessibility_trackers:
+                self.accessibility_trackers[client] = AccessibilityTreeTracker(
+                    client
+                )
+            accessibility_tree = self.accessibility_trackers[client].sync(
+                client, cache.url
+            )
+            cache.accessibility_tree = accessibility_tree
+        else:
+            accessibility_tree = self.dedupe_accessibility_tree(
+                client.send("Accessibility.getFullAXTree", {})["nodes"]
+            )
+            if cache is not None:
+                cache.accessibility_tree = accessibility_tree
 
+        return accessibility_tree
+
+    @beartype
+    @staticmethod
+    def annotate_accessibility_tree(
+        info: BrowserInfo, accessibility_tree: AccessibilityTree
+    ) -> AccessibilityTreeIndex:
+        """Add the bounds of the snapshot to the nodes of the tree"""
         # add the bounding box of each node
-        tree = info["DOMTree"]
-        document = tree["documents"][0]
-        nodes = document["nodes"]
-        backend_node_id = nodes["backendNodeId"]
-        node_names = nodes["nodeName"]
-
-        layout = document["layout"]
-        layout_node_cursor = layout["nodeIndex"]
-        bounds = layout["bounds"]
-        union_bounds = layout["unionBounds"]
-        offsetrect_bounds = layout["offsetRects"]
-        backend_id_to_bound = {}
+        snapshot = info["snapshot"]
+        bounds = snapshot.bounds.tolist()
+        union_bounds = [
+            None if np.isnan(b[0]) else b
+            for b in snapshot.union_bounds.tolist()
+        ]
+        offsetrect_bounds = snapshot.offset_rects
 
         # get the mapping between backend node id and bounding box
-        for idx in range(len(node_names)):
-            if idx not in layout_node_cursor:
-                continue
-            cursor = layout_node_cursor.index(idx)
-            node_bound = bounds[cursor]
-            node_union_bound = union_bounds[cursor]
-            node_offsetrect_bound = offsetrect_bounds[cursor]
-            node_backend_id = backend_node_id[idx]
+        layout_nodes = np.flatnonzero(snapshot.node_to_layout >= 0)
+        backend_id_to_bound = {}
+        for node_backend_id, cursor in zip(
+            snapshot.backend_node_id[layout_nodes].tolist(),
+            snapshot.node_to_layout[layout_nodes].tolist(),
+        ):
             backend_id_to_bound[node_backend_id] = [
-                node_bound,
-                node_union_bound,
-                node_offsetrect_bound,
+                bounds[cursor],
+                union_bounds[cursor],
+                offsetrect_bounds[cursor],
             ]
 
-        parent_graph: dict[str, str] = {}
-        refine_node_ids: list[str] = []
-        for node in accessibility_tree:
-            if "parentId" in node:
-                parent_graph[node["nodeId"]] = node["parentId"]
+        index = AccessibilityTreeIndex(accessibility_tree)
+        refine_rows: list[int] = []
+        for idx, node in enumerate(accessibility_tree):
             if "backendDOMNodeId" not in node:
                 node["bound"] = None
                 node["union_bound"] = None
                 node["offsetrect_bound"] = None
             elif node["backendDOMNodeId"] not in backend_id_to_bound:
-                refine_node_ids.append(node["nodeId"])
+                refine_rows.append(idx)
             else:
                 node["bound"] = backend_id_to_bound[node["backendDOMNodeId"]][
                     0
@@ -341,81 +667,84 @@ class TextObervationProcessor(ObservationProcessor):
                 ][2]
 
         # refine the bounding box for nodes which only appear in the accessibility tree
-        node_ids = [node["nodeId"] for node in accessibility_tree]
-        for refine_node_id in refine_node_ids:
-            child_id = refine_node_id
-            parent_idx: None | int = None
-            while child_id in parent_graph:
-                parent_id = parent_graph[child_id]
-                parent_idx = node_ids.index(parent_id)
-                child_id = parent_id
-                if accessibility_tree[parent_idx]["union_bound"] is not None:
-                    break
-
-            refine_node_idx = node_ids.index(refine_node_id)
-
-            if parent_idx is not None:
-                accessibility_tree[refine_node_idx][
-                    "bound"
-                ] = accessibility_tree[parent_idx]["bound"]
-                accessibility_tree[refine_node_idx][
-                    "union_bound"
-                ] = accessibility_tree[parent_idx]["union_bound"]
-                accessibility_tree[refine_node_idx][
-                    "offsetrect_bound"
-                ] = accessibility_tree[parent_idx]["offsetrect_bound"]
+        for idx in refine_rows:
+            parent_idx = index.ancestor_with_bound(idx)
+            node = accessibility_tree[idx]
+            if parent_idx >= 0:
+                parent = accessibility_tree[parent_idx]
+                node["bound"] = parent["bound"]
+                node["union_bound"] = parent["union_bound"]
+                node["offsetrect_bound"] = parent["offsetrect_bound"]
             else:
-                accessibility_tree[refine_node_idx]["bound"] = None
-                accessibility_tree[refine_node_idx]["union_bound"] = None
-                accessibility_tree[refine_node_idx]["offsetrect_bound"] = None
+                node["bound"] = None
+                node["union_bound"] = None
+                node["offsetrect_bound"] = None
 
-        return accessibility_tree
+        index.update_bounds()
+        return index
 
     @beartype
+    @staticmethod
     def current_viewport_accessibility_tree(
-        self,
         info: BrowserInfo,
-        accessibility_tree: AccessibilityTree,
-    ) -> AccessibilityTree:
-        config = info["config"]
-        subtree = []
-        for node in accessibility_tree:
-            if not node["union_bound"]:
-                continue
-
-            [x, y, width, height] = node["union_bound"]
-            elem_left_bound = x
-            elem_top_bound = y
-            elem_right_bound = x + width
-            elem_lower_bound = y + height
-
-            ok = (
-                elem_left_bound < config["win_right_bound"]
-                and elem_right_bound >= config["win_left_bound"]
-                and elem_top_bound < config["win_lower_bound"]
-                and elem_lower_bound >= config["win_upper_bound"]
-            )
-
-            if ok:
-                subtree.append(node)
-
-        return subtree
+        index: AccessibilityTreeIndex,
+    ) -> AccessibilityTreeIndex:
+        in_viewport = TextObervationProcessor.in_viewport_mask(
+            index.union_bounds, info["config"]
+        )
+        return index.select(in_viewport)
 
     @beartype
     @staticmethod
     def parse_accessibility_tree(
-        accessibility_tree: AccessibilityTree,
+        accessibility_tree: AccessibilityTree | AccessibilityTreeIndex,
+        budget: TokenBudget | None = None,
     ) -> tuple[str, dict[str, Any]]:
-        """Parse the accessibility tree into a string text"""
-        node_id_to_idx = {}
-        for idx, node in enumerate(accessibility_tree):
-            node_id_to_idx[node["nodeId"]] = idx
+        """Parse the accessibility tree into a string text
 
-        obs_nodes_info = {}
+        The tree is walked depth first with an explicit stack and every line
+        goes through the `clean_accesibility_tree` rule as it is emitted, so
+        the output is already cleaned. With a token budget, the lines are
+        counted as they are emitted and the walk stops once it is exhausted.
+        """
+        if not isinstance(accessibility_tree, AccessibilityTreeIndex):
+            accessibility_tree = AccessibilityTreeIndex(accessibility_tree)
+        index = accessibility_tree
+        nodes = index.nodes
 
-        def dfs(idx: int, obs_node_id: str, depth: int) -> str:
-            tree_str = ""
-            node = accessibility_tree[idx]
+        obs_nodes_info = {}
+        lines: list[str] = []
+
+        def append(line: str) -> None:
+            if budget is None:
+                lines.append(line)
+                return
+            sep = "\n" if lines else ""
+            kept = budget.consume(f"{sep}{line}")[len(sep) :]
+            if kept:
+                lines.append(kept)
+
+        def emit(node_line: str) -> None:
+            for line in node_line.split("\n"):
+                if "statictext" in line.lower():
+                    # drop static text repeated in the previous three lines
+                    match = STATIC_TEXT_PATTERN.search(line)
+                    if match:
+                        static_text = match.group(1)
+                        if all(
+                            static_text not in prev_line
+                            for prev_line in lines[-3:]
+                        ):
+                            append(line)
+                else:
+                    append(line)
+
+        stack = [(0, nodes[0].get("elementId", nodes[0]["nodeId"]), 0)]
+        while stack:
+            if budget is not None and budget.exhausted:
+                break
+            idx, obs_node_id, depth = stack.pop()
+            node = nodes[idx]
             indent = "\t" * depth
             valid_node = True
             try:
@@ -443,52 +772,38 @@ class TextObervationProcessor(ObservationProcessor):
                 # empty generic node
                 if not name.strip():
                     if not properties:
-                        if role in [
-                            "generic",
-                            "img",
-                            "list",
-                            "strong",
-                            "paragraph",
-                            "banner",
-                            "navigation",
-                            "Section",
-                            "LabelText",
-                            "Legend",
-                            "listitem",
-                        ]:
+                        if role in EMPTY_NODE_ROLES:
                             valid_node = False
                     elif role in ["listitem"]:
                         valid_node = False
 
                 if valid_node:
-                    tree_str += f"{indent}{node_str}"
-                    obs_nodes_info[obs_node_id] = {
-                        "backend_id": node["backendDOMNodeId"],
-                        "bound": node["bound"],
-                        "union_bound": node["union_bound"],
-                        "offsetrect_bound": node["offsetrect_bound"],
-                        "text": node_str,
-                    }
+                    emit(f"{indent}{node_str}")
+                    obs_nodes_info[obs_node_id] = ObsNodeInfo(
+                        node["backendDOMNodeId"],
+                        node["bound"],
+                        node["union_bound"],
+                        node["offsetrect_bound"],
+                        node_str,
+                    )
 
             except Exception as e:
                 valid_node = False
 
-            for _, child_node_id in enumerate(node["childIds"]):
-                if child_node_id not in node_id_to_idx:
-                    continue
-                # mark this to save some tokens
-                child_depth = depth + 1 if valid_node else depth
-                child_str = dfs(
-                    node_id_to_idx[child_node_id], child_node_id, child_depth
+            # mark this to save some tokens
+            child_depth = depth + 1 if valid_node else depth
+            # push in reverse so that the first child is visited first
+            for child_idx in reversed(index.children[idx]):
+                child = nodes[child_idx]
+                stack.append(
+                    (
+                        child_idx,
+                        child.get("elementId", child["nodeId"]),
+                        child_depth,
+                    )
                 )
-                if child_str.strip():
-                    if tree_str.strip():
-                        tree_str += "\n"
-                    tree_str += child_str
 
-            return tree_str
-
-        tree_str = dfs(0, accessibility_tree[0]["nodeId"], 0)
+        tree_str = "\n".join(lines)
         return tree_str, obs_nodes_info
 
     @beartype
@@ -499,9 +814,7 @@ class TextObervationProcessor(ObservationProcessor):
         for line in tree_str.split("\n"):
             if "statictext" in line.lower():
                 prev_lines = clean_lines[-3:]
-                pattern = r"\[\d+\] StaticText '([^']+)'"
-
-                match = re.search(pattern, line)
+                match = STATIC_TEXT_PATTERN.search(line)
                 if match:
                     static_text = match.group(1)
                     if all(
@@ -516,62 +829,466 @@ class TextObervationProcessor(ObservationProcessor):
 
     @beartype
     def process(self, page: Page, client: CDPSession) -> str:
-        # get the tab info
-        open_tabs = page.context.pages
+        return self.collect(self.submit(page, client))
+
+    def submit(
+        self, page: Page, client: CDPSession
+    ) -> "PendingTextObservation":
+        """Fetch everything the observation needs from the browser and
+        start serializing it, in the worker pool when there is one. The
+        browser can be used again as soon as this returns, `collect` waits
+        for the observation."""
+        if self.backend == "page_script":
+            return self.submit_page_script(page)
+
         try:
-            tab_titles = [tab.title() for tab in open_tabs]
-            current_tab_idx = open_tabs.index(page)
-            for idx in range(len(open_tabs)):
-                if idx == current_tab_idx:
-                    tab_titles[
-                        idx
-                    ] = f"Tab {idx} (current): {open_tabs[idx].title()}"
-                else:
-                    tab_titles[idx] = f"Tab {idx}: {open_tabs[idx].title()}"
-            tab_title_str = " | ".join(tab_titles)
+            window, tab_titles = self.fetch_window_info(page)
         except Exception:
-            tab_title_str = " | ".join(
-                ["Tab {idx}" for idx in range(len(open_tabs))]
-            )
+            page.wait_for_load_state("load", timeout=500)
+            window, tab_titles = self.fetch_window_info(page)
+
+        # nothing changed since the last observation, e.g. a failed action
+        fingerprint = self.page_fingerprint(page, window, tab_titles)
+        memoized = self.memoized_observation(fingerprint, page.url)
+        if memoized is not None:
+            return memoized
 
         try:
-            browser_info = self.fetch_browser_info(page, client)
+            browser_info = self.fetch_browser_info(
+                page, client, window, tab_titles
+            )
         except Exception:
             page.wait_for_load_state("load", timeout=500)
-            browser_info = self.fetch_browser_info(page, client)
+            # the page changed since, the memo has to match the retry
+            window, tab_titles = self.fetch_window_info(page)
+            fingerprint = self.page_fingerprint(page, window, tab_titles)
+            browser_info = self.fetch_browser_info(
+                page, client, window, tab_titles
+            )
 
-        if self.current_viewport_only:
-            self.retrieve_viewport_info(browser_info)
+        needs_content, needs_tree = self.capture_needs()
+        page_content = page.content() if needs_content else None
+        accessibility_tree = (
+            self.fetch_page_accessibility_tree(browser_info, client)
+            if needs_tree
+            else None
+        )
+        return self.submit_capture(
+            page,
+            client,
+            fingerprint,
+            browser_info,
+            accessibility_tree,
+            page_content,
+        )
 
-        if self.observation_type == "html":
-            if self.current_viewport_only:
-                html = self.current_viewport_html(browser_info)
-                content = html
-            else:
-                content = page.content()
-        elif self.observation_type == "accessibility_tree":
-            accessibility_tree = self.fetch_page_accessibility_tree(
-                browser_info, client
-            )
-            if self.current_viewport_only:
-                accessibility_tree = self.current_viewport_accessibility_tree(
-                    browser_info, accessibility_tree
+    def memoized_observation(
+        self, fingerprint: tuple[Any, ...] | None, url: str
+    ) -> "PendingTextObservation | None":
+        memo = self.observation_memo
+        if fingerprint is not None and memo is not None:
+            if memo.fingerprint == fingerprint:
+                return PendingTextObservation(
+                    fingerprint, memo.browser_config, None, memo, url
                 )
-            content, obs_nodes_info = self.parse_accessibility_tree(
-                accessibility_tree
-            )
-            content = self.clean_accesibility_tree(content)
-            self.obs_nodes_info = obs_nodes_info
-            self.meta_data["obs_nodes_info"] = obs_nodes_info
-        else:
+        return None
+
+    def observation_types(self) -> list[str]:
+        if self.observation_type not in ("html", "accessibility_tree"):
             raise ValueError(
                 f"Invalid observatrion type: {self.observation_type}"
             )
+        return [self.observation_type, *self.extra_observation_types]
+
+    def assign_element_ids(
+        self, client: Any, accessibility_tree: AccessibilityTree
+    ) -> None:
+        if self.stable_element_ids:
+            if client not in self.element_ids:
+                self.element_ids[client] = StableElementIds()
+            self.element_ids[client].assign(accessibility_tree)
+
+    def capture_needs(self) -> tuple[bool, bool]:
+        """Whether the observation needs the html of the page and the
+        accessibility tree, besides the capture of the browser info"""
+        observation_types = self.observation_types()
+        return (
+            "html" in observation_types and not self.current_viewport_only,
+            "accessibility_tree" in observation_types,
+        )
+
+    def submit_capture(
+        self,
+        page: Page,
+        client: Any,
+        fingerprint: tuple[Any, ...] | None,
+        browser_info: BrowserInfo,
+        accessibility_tree: AccessibilityTree | None,
+        page_content: str | None,
+    ) -> "PendingTextObservation":
+        """Start serializing a capture of the page, the steps that follow
+        the I/O of `submit` and of the async `asubmit`"""
+        tab_title_str = self.format_tab_titles(
+            page, browser_info["tab_titles"]
+        )
+        if accessibility_tree is not None:
+            self.assign_element_ids(client, accessibility_tree)
+        return self.submit_job(
+            fingerprint,
+            browser_info,
+            tab_title_str,
+            accessibility_tree,
+            page_content,
+            page.url,
+        )
+
+    def submit_job(
+        self,
+        fingerprint: tuple[Any, ...] | None,
+        browser_info: BrowserInfo,
+        tab_title_str: str,
+        accessibility_tree: AccessibilityTree | None,
+        page_content: str | None,
+        url: str,
+    ) -> "PendingTextObservation":
+        """Start serializing what was fetched from the browser"""
+        observation_types = self.observation_types()
+        job = TextObservationJob(
+            observation_types=observation_types,
+            current_viewport_only=self.current_viewport_only,
+            info=browser_info,
+            accessibility_tree=accessibility_tree,
+            page_content=page_content,
+            header=tab_title_str,
+            max_obs_length=self.max_obs_length,
+        )
+        if self.observation_workers > 0:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    self.observation_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=init_observation_worker,
+                    initargs=(self.tokenizer,),
+                )
+            future = self.executor.submit(serialize_in_worker, job)
+        else:
+            future = Future()
+            future.set_result(serialize_text_observation(job, self.tokenizer))
+        return PendingTextObservation(
+            fingerprint, browser_info["config"], future, None, url
+        )
 
-        self.browser_config = browser_info["config"]
-        content = f"{tab_title_str}\n\n{content}"
+    def collect(self, pending: "PendingTextObservation") -> str:
+        """Wait for an observation started by `submit`"""
+        memo = pending.memo
+        if memo is None:
+            assert pending.future is not None
+            result = pending.future.result()
+            memo = TextObservationMemo(
+                fingerprint=pending.fingerprint or (),
+                content=result.content,
+                obs_nodes_info=result.obs_nodes_info,
+                num_tokens=result.num_tokens,
+                browser_config=pending.browser_config,
+                extra=result.extra,
+            )
+            self.observation_memo = (
+                memo if pending.fingerprint is not None else None
+            )
+        else:
+            memo.hits += 1
+
+        if self.observation_type == "accessibility_tree":
+            self.obs_nodes_info = memo.obs_nodes_info
+            self.meta_data["obs_nodes_info"] = memo.obs_nodes_info
+        self.meta_data["num_tokens"] = memo.num_tokens
+        self.browser_config = memo.browser_config
+        self.extra_observations = memo.extra
+        if self.delta_keyframe_interval:
+            return self.delta_observation(memo.content)
+        if self.collapse_repeated_subtrees:
+            return self.collapse_subtrees(memo.content, pending.url)
+        return memo.content
+
+    def collapse_subtrees(self, content: str, url: str) -> str:
+        """Replace the lines below the subtrees of `content`, the page at
+        `url`, that were already shown in full on another page this
+        episode by a single line, e.g. the menus repeated by a site. The
+        content of the page itself is kept while the agent works on it.
+        The nodes stay in `obs_nodes_info`, so they can still be acted
+        on."""
+        header, _, tree = content.partition("\n\n")
+        lines = tree.split("\n")
+        depths = [len(line) - len(line.lstrip("\t")) for line in lines]
+
+        # the element ids change with every navigation, the content of the
+        # lines without them identifies the repeated parts of a site
+        matches = [ELEMENT_ID_PATTERN.match(line) for line in lines]
+        texts = [
+            line[match.end() :].strip() if match else line.strip()
+            for line, match in zip(lines, matches)
+        ]
+
+        # end of the subtree of every line and the hash of its content,
+        # which is the same wherever the subtree is indented
+        ends = list(range(1, len(lines) + 1))
+        hashes = [0] * len(lines)
+        stack: list[int] = []
+        children: list[list[int]] = [[] for _ in lines]
+        for i, depth in enumerate(depths):
+            while stack and depths[stack[-1]] >= depth:
+                stack.pop()
+            if stack:
+                children[stack[-1]].append(i)
+            stack.append(i)
+        for i in reversed(range(len(lines))):
+            if children[i]:
+                ends[i] = ends[children[i][-1]]
+            hashes[i] = hash((texts[i], tuple(hashes[c] for c in children[i])))
+
+        expanded, self.expanded_subtrees = self.expanded_subtrees, set()
+        kept = []
+        shown = []
+        collapsed = [0] * (len(lines) + 1)
+        i = 0
+        while i < len(lines):
+            kept.append(lines[i])
+            size = ends[i] - i
+            # the page itself is never collapsed
+            if size < MIN_COLLAPSED_SUBTREE_LINES or depths[i] == 0:
+                i += 1
+                continue
+            match = matches[i]
+            element_id = match.group(1) if match else None
+            if (
+                element_id is not None
+                and element_id not in expanded
+                and self.shown_subtrees.get(hashes[i], url) != url
+            ):
+                indent = "\t" * (depths[i] + 1)
+                kept.append(
+                    f"{indent}({size - 1} more lines already shown before,"
+                    f" expand [{element_id}] to show them again)"
+                )
+                collapsed[i + 1] = 1
+                i = ends[i]
+            else:
+                shown.append(i)
+                i += 1
+
+        # only the subtrees shown in full count as shown
+        collapsed_before = np.cumsum(collapsed)
+        for i in shown:
+            if collapsed_before[ends[i]] == collapsed_before[i]:
+                self.shown_subtrees.setdefault(hashes[i], url)
+        return f"{header}\n\n" + "\n".join(kept)
+
+    def expand(self, element_id: str) -> None:
+        """Show the collapsed subtree of `element_id` in full in the next
+        observation"""
+        self.expanded_subtrees.add(element_id)
+
+    def delta_observation(self, content: str) -> str:
+        """Return the changes of `content` since the previous observation,
+        or `content` itself for a keyframe"""
+        header, _, tree = content.partition("\n\n")
+        lines = {}
+        for line in tree.split("\n"):
+            match = ELEMENT_ID_PATTERN.match(line)
+            if match:
+                lines[match.group(1)] = line.strip()
+
+        base, self.delta_base = self.delta_base, lines
+        if (
+            base is not None
+            and self.observations_since_keyframe < self.delta_keyframe_interval
+        ):
+            delta = diff_accessibility_trees(base, lines)
+            # a page that changed this much is sent in full
+            if len(delta) < len(tree) // 2:
+                self.observations_since_keyframe += 1
+                self.meta_data["num_tokens"] = None
+                return f"{header}\n\n{delta}"
+        self.observations_since_keyframe = 1
         return content
 
+    def reset(self) -> None:
+        """Forget the observations of the previous episode"""
+        self.observation_memo = None
+        self.delta_base = None
+        self.observations_since_keyframe = 0
+        self.shown_subtrees.clear()
+        self.expanded_subtrees.clear()
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    @staticmethod
+    def page_fingerprint(
+        page: Page, window: dict[str, Any], tab_titles: list[str] | None
+    ) -> tuple[Any, ...] | None:
+        """Return what identifies the observation of the page, None when
+        the page cannot tell whether its DOM changed"""
+        if window["domVersion"] is None or tab_titles is None:
+            return None
+        open_tabs = page.context.pages
+        return (
+            page.url,
+            window["domVersion"],
+            window["pageXOffset"],
+            window["pageYOffset"],
+            window["screenWidth"],
+            window["screenHeight"],
+            tuple(tab_titles),
+            open_tabs.index(page) if page in open_tabs else -1,
+        )
+
+    @beartype
+    def fetch_page_script_accessibility_tree(
+        self, page: Page
+    ) -> tuple[BrowserConfig, list[str] | None, AccessibilityTree]:
+        """Build the (already culled and pruned) accessibility tree inside
+        the page with ACCESSIBILITY_TREE_JS, together with the tab titles"""
+        open_tabs = page.context.pages
+        result, *tab_titles = run_concurrently(
+            page,
+            [
+                page._impl_obj.evaluate(  # type: ignore[attr-defined]
+                    ACCESSIBILITY_TREE_JS, self.page_script_arguments()
+                )
+            ]
+            + [tab._impl_obj.title() for tab in open_tabs],  # type: ignore[attr-defined]
+            return_exceptions=True,
+        )
+        return self.parse_page_script_result(result, tab_titles)
+
+    def page_script_arguments(self) -> dict[str, Any]:
+        return {
+            "currentViewportOnly": self.current_viewport_only,
+            "prunedRoles": EMPTY_NODE_ROLES,
+            "stableElementIds": self.stable_element_ids,
+        }
+
+    @staticmethod
+    def parse_page_script_result(
+        result: dict[str, Any] | BaseException,
+        tab_titles: list[str | BaseException],
+    ) -> tuple[BrowserConfig, list[str] | None, AccessibilityTree]:
+        """Convert the result of ACCESSIBILITY_TREE_JS into the browser
+        config, the tab titles and the accessibility tree"""
+        if isinstance(result, BaseException):
+            raise result
+
+        window = result["window"]
+        assert window["devicePixelRatio"] == 1.0, "devicePixelRatio is not 1.0"
+        config: BrowserConfig = {
+            "win_upper_bound": window["pageYOffset"],
+            "win_left_bound": window["pageXOffset"],
+            "win_width": window["screenWidth"],
+            "win_height": window["screenHeight"],
+            "win_right_bound": window["pageXOffset"] + window["screenWidth"],
+            "win_lower_bound": window["pageYOffset"] + window["screenHeight"],
+            "device_pixel_ratio": window["devicePixelRatio"],
+        }
+
+        accessibility_tree: AccessibilityTree = []
+        for (
+            node_id,
+            role,
+            name,
+            props,
+            child_ids,
+            bound,
+            union_bound,
+        ) in result["nodes"]:
+            accessibility_tree.append(
+                {  # type: ignore[typeddict-item]
+                    "nodeId": str(node_id),
+                    "role": {"value": role},
+                    "name": {"value": name},
+                    "properties": [
+                        {"name": key, "value": {"value": value}}
+                        for key, value in props.items()
+                    ],
+                    "childIds": [str(child_id) for child_id in child_ids],
+                    "backendDOMNodeId": node_id,
+                    "bound": bound,
+                    "union_bound": union_bound,
+                    "offsetrect_bound": None,
+                }
+            )
+
+        if any(isinstance(title, BaseException) for title in tab_titles):
+            return config, None, accessibility_tree
+        return config, tab_titles, accessibility_tree  # type: ignore[return-value]
+
+    @beartype
+    def submit_page_script(self, page: Page) -> "PendingTextObservation":
+        try:
+            (
+                config,
+                tab_titles,
+                accessibility_tree,
+            ) = self.fetch_page_script_accessibility_tree(page)
+        except Exception:
+            page.wait_for_load_state("load", timeout=500)
+            (
+                config,
+                tab_titles,
+                accessibility_tree,
+            ) = self.fetch_page_script_accessibility_tree(page)
+        return self.page_script_observation(
+            page, config, tab_titles, accessibility_tree
+        )
+
+    def page_script_observation(
+        self,
+        page: Page,
+        config: BrowserConfig,
+        tab_titles: list[str] | None,
+        accessibility_tree: AccessibilityTree,
+    ) -> "PendingTextObservation":
+        tab_title_str = self.format_tab_titles(page, tab_titles)
+        budget = None
+        if self.max_obs_length and self.tokenizer is not None:
+            budget = TokenBudget(self.tokenizer, self.max_obs_length)
+            header = budget.consume(f"{tab_title_str}\n\n")
+        else:
+            header = f"{tab_title_str}\n\n"
+
+        # the page already did the heavy lifting, parse in this process
+        content, obs_nodes_info = self.parse_accessibility_tree(
+            accessibility_tree, budget
+        )
+        future: Future[SerializedTextObservation] = Future()
+        future.set_result(
+            SerializedTextObservation(
+                f"{header}{content}",
+                obs_nodes_info,
+                budget.used if budget is not None else None,
+            )
+        )
+        return PendingTextObservation(None, config, future, None, page.url)
+
+    @staticmethod
+    def format_tab_titles(page: Page, tab_titles: list[str] | None) -> str:
+        open_tabs = page.context.pages
+        if tab_titles is not None and page in open_tabs:
+            current_tab_idx = open_tabs.index(page)
+            tab_title_str = " | ".join(
+                f"Tab {idx} (current): {title}"
+                if idx == current_tab_idx
+                else f"Tab {idx}: {title}"
+                for idx, title in enumerate(tab_titles)
+            )
+        else:
+            tab_title_str = " | ".join(
+                ["Tab {idx}" for idx in range(len(open_tabs))]
+            )
+        return tab_title_str
+
     @beartype
     def get_element_center(self, element_id: str) -> tuple[float, float]:
         node_info = self.obs_nodes_info[element_id]
@@ -590,6 +1307,149 @@ class TextObervationProcessor(ObservationProcessor):
         )
 
 
+@dataclass
+class TextObservationJob:
+    """Everything needed to serialize a text observation without the
+    browser, small enough to be sent to a worker process"""
+
+    # the main observation type first, then the extra ones
+    observation_types: list[str]
+    current_viewport_only: bool
+    info: BrowserInfo
+    accessibility_tree: AccessibilityTree | None
+    # the html of the whole page, when it is an observation
+    page_content: str | None
+    header: str
+    max_obs_length: int
+
+
+@dataclass
+class SerializedTextObservation:
+    content: str
+    obs_nodes_info: dict[str, Any]
+    num_tokens: int | None
+    # observation type -> text of the extra representations
+    extra: dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class PendingTextObservation:
+    fingerprint: tuple[Any, ...] | None
+    browser_config: BrowserConfig
+    future: "Future[SerializedTextObservation] | None"
+    # set when the last observation is returned again
+    memo: TextObservationMemo | None
+    url: str  # of the page
+
+
+def serialize_text_observation(
+    job: TextObservationJob, tokenizer: tiktoken.core.Encoding | None
+) -> SerializedTextObservation:
+    """Serialize every observation type of `job`, the shown nodes and the
+    number of tokens are those of the main one"""
+    processor = TextObervationProcessor
+    info = job.info
+    if job.current_viewport_only:
+        processor.retrieve_viewport_info(info)
+
+    index = None
+    if job.accessibility_tree is not None:
+        index = processor.annotate_accessibility_tree(
+            info, job.accessibility_tree
+        )
+        if job.current_viewport_only:
+            index = processor.current_viewport_accessibility_tree(info, index)
+
+    results = []
+    for observation_type in job.observation_types:
+        # every representation gets the full token budget
+        budget = None
+        if job.max_obs_length and tokenizer is not None:
+            budget = TokenBudget(tokenizer, job.max_obs_length)
+            header = budget.consume(f"{job.header}\n\n")
+        else:
+            header = f"{job.header}\n\n"
+
+        obs_nodes_info: dict[str, Any] = {}
+        if observation_type == "accessibility_tree":
+            assert index is not None
+            content, obs_nodes_info = processor.parse_accessibility_tree(
+                index, budget
+            )
+        else:
+            if job.page_content is not None:
+                content = job.page_content
+            else:
+                content = processor.current_viewport_html(info)
+            if budget is not None:
+                content = budget.consume(content)
+
+        results.append(
+            SerializedTextObservation(
+                f"{header}{content}",
+                obs_nodes_info,
+                budget.used if budget is not None else None,
+            )
+        )
+
+    main, *extra = results
+    main.extra = {
+        observation_type: result.content
+        for observation_type, result in zip(job.observation_types[1:], extra)
+    }
+    return main
+
+
+def diff_accessibility_trees(
+    before: dict[str, str], after: dict[str, str]
+) -> str:
+    """Describe the added, changed and removed lines between two serialized
+    trees, given as element id -> line in tree order. An added line is
+    placed after the line that precedes it in `after`."""
+    added, changed = [], []
+    previous_id = None
+    for element_id, line in after.items():
+        if element_id not in before:
+            position = (
+                f"after [{previous_id}]" if previous_id else "at the top"
+            )
+            added.append(f"{line} ({position})")
+        elif before[element_id] != line:
+            changed.append(line)
+        previous_id = element_id
+    removed = [
+        line for element_id, line in before.items() if element_id not in after
+    ]
+    if not (added or changed or removed):
+        return f"{DELTA_OBSERVATION_MARKER} none"
+
+    sections = [DELTA_OBSERVATION_MARKER]
+    for title, section in [
+        ("added", added),
+        ("changed", changed),
+        ("removed", removed),
+    ]:
+        if section:
+            sections.append(f"{title}:")
+            sections.extend(section)
+    return "\n".join(sections)
+
+
+_worker_tokenizer: tiktoken.core.Encoding | None = None
+
+
+def init_observation_worker(tokenizer: tiktoken.core.Encoding | None) -> None:
+    # the tokenizer is sent once per worker instead of once per job
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer
+
+
+def serialize_in_worker(
+    job: TextObservationJob,
+) -> SerializedTextObservation:
+    return serialize_text_observation(job, _worker_tokenizer)
+
+
 class ImageObservationProcessor(ObservationProcessor):
     def __init__(self, observation_type: str):
         self.observation_type = observation_type
@@ -605,9 +1465,72 @@ class ImageObservationProcessor(ObservationProcessor):
         return screenshot
 
 
+class LazyObservation(dict[str, Observation]):
+    """Observation dict whose deferred entries are only computed when they
+    are read for the first time.
+
+    Deferred entries describe the page at the step that produced them, so
+    they expire once the environment moves on. Reading an entry after
+    `expire` raises, instead of silently describing a later page.
+    """
+
+    def __init__(
+        self,
+        observations: dict[str, Observation],
+        deferred: dict[str, Callable[[], Observation]],
+    ) -> None:
+        super().__init__(observations)
+        self.deferred = deferred
+        self.expired = False
+
+    def __missing__(self, key: str) -> Observation:
+        if key not in self.deferred:
+            raise KeyError(key)
+        if self.expired:
+            raise RuntimeError(
+                f"The {key} observation was not read before the next step,"
+                " use the eager observation mode to always capture it"
+            )
+        value = self.deferred.pop(key)()
+        self[key] = value
+        return value
+
+    def expire(self) -> None:
+        self.expired = True
+
+    def __contains__(self, key: object) -> bool:
+        return super().__contains__(key) or key in self.deferred
+
+    def __iter__(self) -> Iterator[str]:
+        yield from super().__iter__()
+        yield from list(self.deferred)
+
+    def __len__(self) -> int:
+        return super().__len__() + len(self.deferred)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self else default
+
+    def keys(self) -> Any:
+        return list(self)
+
+    def values(self) -> Any:
+        return [self[key] for key in self]
+
+    def items(self) -> Any:
+        return [(key, self[key]) for key in self]
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        # e.g. sent to the main process by a vector env worker
+        return (dict, (dict(self.items()),))
+
+
 class ObservationHandler:
     """Main entry point to access all observation processor"""
 
+    text_processor_class = TextObervationProcessor
+    image_processor_class = ImageObservationProcessor
+
     def __init__(
         self,
         main_observation_type: str,
@@ -615,12 +1538,45 @@ class ObservationHandler:
         image_observation_type: str,
         current_viewport_only: bool,
         viewport_size: ViewportSize,
+        max_obs_length: int = 0,
+        tokenizer: tiktoken.core.Encoding | None = None,
+        incremental_accessibility_tree: bool = False,
+        image_observation_mode: str = "auto",
+        text_observation_backend: str = "cdp",
+        observation_workers: int = 0,
+        extra_text_observation_types: list[str] = [],
+        stable_element_ids: bool = False,
+        delta_keyframe_interval: int = 0,
+        collapse_repeated_subtrees: bool = False,
     ) -> None:
         self.main_observation_type = main_observation_type
-        self.text_processor = TextObervationProcessor(
-            text_observation_type, current_viewport_only, viewport_size
+        # "lazy" only takes the screenshot when obs["image"] is read, "auto"
+        # is eager when the image is the main observation
+        if image_observation_mode == "auto":
+            image_observation_mode = (
+                "eager" if main_observation_type == "image" else "lazy"
+            )
+        if image_observation_mode not in ("lazy", "eager"):
+            raise ValueError(
+                f"Invalid image observation mode: {image_observation_mode}"
+            )
+        self.image_observation_mode = image_observation_mode
+        self.last_observation: LazyObservation | None = None
+        self.text_processor = self.text_processor_class(
+            text_observation_type,
+            current_viewport_only,
+            viewport_size,
+            max_obs_length=max_obs_length,
+            tokenizer=tokenizer,
+            incremental_accessibility_tree=incremental_accessibility_tree,
+            backend=text_observation_backend,
+            observation_workers=observation_workers,
+            extra_observation_types=extra_text_observation_types,
+            stable_element_ids=stable_element_ids,
+            delta_keyframe_interval=delta_keyframe_interval,
+            collapse_repeated_subtrees=collapse_repeated_subtrees,
         )
-        self.image_processor = ImageObservationProcessor(
+        self.image_processor = self.image_processor_class(
             image_observation_type
         )
         self.viewport_size = viewport_size
@@ -647,21 +1603,67 @@ class ObservationHandler:
             dtype=np.uint8,
         )
 
-        return spaces.Dict({"text": text_space, "image": image_space})
+        # the extra text representations are exposed under their type
+        extra_spaces = {
+            extra_type: text_space
+            for extra_type in self.text_processor.extra_observation_types
+        }
+        return spaces.Dict(
+            {"text": text_space, "image": image_space, **extra_spaces}
+        )
 
     @beartype
     def get_observation(
         self, page: Page, client: CDPSession
     ) -> dict[str, Observation]:
-        text_obs = self.text_processor.process(page, client)
-        image_obs = self.image_processor.process(page, client)
-        return {"text": text_obs, "image": image_obs}
+        return self.submit_observation(page, client)()
+
+    def submit_observation(
+        self, page: Page, client: CDPSession
+    ) -> Callable[[], dict[str, Observation]]:
+        """Capture the observation and return a function that waits for the
+        text to be serialized. The page can be used in between, e.g. while
+        the text is parsed in a worker process."""
+        self.expire_observation()
+        pending = self.text_processor.submit(page, client)
+        if self.image_observation_mode == "eager":
+            # taken while the text is serialized
+            image_obs = self.image_processor.process(page, client)
+
+        def finish() -> dict[str, Observation]:
+            text_obs = self.text_processor.collect(pending)
+            extra_obs = self.text_processor.extra_observations
+            if self.image_observation_mode == "eager":
+                return {"text": text_obs, "image": image_obs, **extra_obs}
+            self.last_observation = LazyObservation(
+                {"text": text_obs, **extra_obs},
+                {"image": lambda: self.image_processor.process(page, client)},
+            )
+            return self.last_observation
+
+        return finish
+
+    def expire_observation(self) -> None:
+        """Called before the page changes, the deferred observations of the
+        last step can no longer be captured"""
+        if self.last_observation is not None:
+            self.last_observation.expire()
+            self.last_observation = None
+
+    def reset(self) -> None:
+        self.expire_observation()
+        self.text_processor.reset()
+
+    def close(self) -> None:
+        self.text_processor.close()
 
     @beartype
     def get_observation_metadata(self) -> dict[str, ObservationMetadata]:
+        # the processors update their metadata in place, every observation
+        # keeps its own copy, e.g. its `num_tokens` in a trajectory
         return {
-            "text": self.text_processor.meta_data,
-            "image": self.image_processor.meta_data,
+            "text": self.text_processor.meta_data.copy(),
+            "image": self.image_processor.meta_data.copy(),
         }
 
     @property
@@ -673,3 +1675,180 @@ class ObservationHandler:
             return self.image_processor
         else:
             raise ValueError("Invalid main observation type")
+
+
+class AsyncTextObservationProcessor(TextObervationProcessor):
+    """`TextObervationProcessor` for the pages of the async Playwright API.
+
+    The browser is asked for the same captures, awaited on the running
+    event loop, and they are serialized by the same code. The incremental
+    accessibility tree is not supported.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        if self.incremental_accessibility_tree:
+            raise ValueError(
+                "The incremental accessibility tree is not supported for async pages"
+            )
+
+    async def afetch_window_info(
+        self, page: APage
+    ) -> tuple[dict[str, Any], list[str] | None]:
+        window, *tab_titles = await asyncio.gather(
+            page.evaluate(BROWSER_INFO_JS),
+            *[tab.title() for tab in page.context.pages],
+            return_exceptions=True,
+        )
+        if isinstance(window, BaseException):
+            raise window
+        if any(isinstance(title, BaseException) for title in tab_titles):
+            return window, None
+        return window, tab_titles
+
+    async def afetch_browser_info(
+        self,
+        page: APage,
+        client: ACDPSession,
+        window: dict[str, Any] | None = None,
+        tab_titles: list[str] | None = None,
+    ) -> BrowserInfo:
+        if window is None:
+            window, tab_titles = await self.afetch_window_info(page)
+        info = self.cached_browser_info(page.url, client, window, tab_titles)
+        if info is None:
+            tree, *responses = await asyncio.gather(
+                *self.capture_commands(client)
+            )
+            info = self.store_capture(
+                page.url, client, window, tab_titles, tree, responses
+            )
+        return info
+
+    async def afetch_page_accessibility_tree(
+        self, client: ACDPSession
+    ) -> AccessibilityTree:
+        cache = self.page_cache.get(client)
+        if cache is not None and cache.accessibility_tree is not None:
+            return cache.accessibility_tree
+        accessibility_tree = self.dedupe_accessibility_tree(
+            (await client.send("Accessibility.getFullAXTree", {}))["nodes"]
+        )
+        if cache is not None:
+            cache.accessibility_tree = accessibility_tree
+        return accessibility_tree
+
+    async def afetch_page_script_accessibility_tree(
+        self, page: APage
+    ) -> tuple[BrowserConfig, list[str] | None, AccessibilityTree]:
+        result, *tab_titles = await asyncio.gather(
+            page.evaluate(ACCESSIBILITY_TREE_JS, self.page_script_arguments()),
+            *[tab.title() for tab in page.context.pages],
+            return_exceptions=True,
+        )
+        return self.parse_page_script_result(result, tab_titles)
+
+    async def asubmit(
+        self, page: APage, client: ACDPSession
+    ) -> PendingTextObservation:
+        """Async `submit`"""
+        if self.backend == "page_script":
+            try:
+                result = await self.afetch_page_script_accessibility_tree(page)
+            except Exception:
+                await page.wait_for_load_state("load", timeout=500)
+                result = await self.afetch_page_script_accessibility_tree(page)
+            return self.page_script_observation(page, *result)  # type: ignore[arg-type]
+
+        try:
+            window, tab_titles = await self.afetch_window_info(page)
+        except Exception:
+            await page.wait_for_load_state("load", timeout=500)
+            window, tab_titles = await self.afetch_window_info(page)
+
+        fingerprint = self.page_fingerprint(page, window, tab_titles)  # type: ignore[arg-type]
+        memoized = self.memoized_observation(fingerprint, page.url)
+        if memoized is not None:
+            return memoized
+
+        try:
+            browser_info = await self.afetch_browser_info(
+                page, client, window, tab_titles
+            )
+        except Exception:
+            await page.wait_for_load_state("load", timeout=500)
+            window, tab_titles = await self.afetch_window_info(page)
+            fingerprint = self.page_fingerprint(page, window, tab_titles)  # type: ignore[arg-type]
+            browser_info = await self.afetch_browser_info(
+                page, client, window, tab_titles
+            )
+
+        needs_content, needs_tree = self.capture_needs()
+        page_content = await page.content() if needs_content else None
+        accessibility_tree = (
+            await self.afetch_page_accessibility_tree(client)
+            if needs_tree
+            else None
+        )
+        return self.submit_capture(
+            page,  # type: ignore[arg-type]
+            client,
+            fingerprint,
+            browser_info,
+            accessibility_tree,
+            page_content,
+        )
+
+    async def aprocess(self, page: APage, client: ACDPSession) -> str:
+        pending = await self.asubmit(page, client)
+        if pending.future is not None:
+            # the other coroutines of the loop run while a worker
+            # serializes the observation
+            await asyncio.wrap_future(pending.future)
+        return self.collect(pending)
+
+
+class AsyncImageObservationProcessor(ImageObservationProcessor):
+    async def aprocess(
+        self, page: APage, client: ACDPSession
+    ) -> npt.NDArray[np.uint8]:
+        try:
+            screenshot = png_bytes_to_numpy(await page.screenshot())
+        except:
+            await page.wait_for_event("load")
+            screenshot = png_bytes_to_numpy(await page.screenshot())
+        return screenshot
+
+
+class AsyncObservationHandler(ObservationHandler):
+    """`ObservationHandler` for the pages of the async Playwright API.
+
+    A screenshot can not be deferred to the first read of the observation
+    without blocking the event loop, so the image is always taken with
+    the text.
+    """
+
+    text_processor_class = AsyncTextObservationProcessor
+    image_processor_class = AsyncImageObservationProcessor
+    text_processor: AsyncTextObservationProcessor
+    image_processor: AsyncImageObservationProcessor
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        # "auto" is lazy for text observations
+        if self.image_observation_mode != "eager":
+            raise ValueError(
+                "The image observation of async pages is always eager"
+            )
+
+    async def aget_observation(
+        self, page: APage, client: ACDPSession
+    ) -> dict[str, Observation]:
+        pending = await self.text_processor.asubmit(page, client)
+        # taken while the text is serialized
+        image_obs = await self.image_processor.aprocess(page, client)
+        if pending.future is not None:
+            await asyncio.wrap_future(pending.future)
+        text_obs = self.text_processor.collect(pending)
+        extra_obs = self.text_processor.extra_observations
+        return {"text": text_obs, "image": image_obs, **extra_obs}
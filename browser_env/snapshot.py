@@ -0,0 +1,253 @@
+"""Columnar view of the `DOMSnapshot.captureSnapshot` result.
+
+The CDP payload stores the DOM and the layout tree as parallel lists.
+Looking up the layout row of a DOM node with `list.index` is linear in the
+number of layout rows, so every per-node loop over it becomes quadratic.
+`DOMSnapshotArrays` turns the columns into NumPy arrays once per observation
+and precomputes the node -> layout row mapping that every processor shares.
+"""
+from dataclasses import dataclass, field, replace
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+
+
+@dataclass
+class DOMSnapshotArrays:
+    strings: list[str]
+    # per DOM node, shape (N,)
+    parent: npt.NDArray[np.int64]  # -1 for the root
+    node_name: npt.NDArray[np.int64]  # index into `strings`
+    node_value: npt.NDArray[np.int64]  # index into `strings`, -1 if absent
+    backend_node_id: npt.NDArray[np.int64]
+    attributes: list[list[int]]  # flattened (name, value) string indices
+    node_to_layout: npt.NDArray[np.int64]  # first layout row, -1 if absent
+    # per layout row, shape (L,) and (L, 4)
+    layout_node_index: npt.NDArray[np.int64]
+    bounds: npt.NDArray[np.float64]  # [x, y, width, height]
+    offset_rects: list[list[float]]
+    # requested computed style -> string index per layout row, -1 if absent
+    styles: dict[str, npt.NDArray[np.int64]] = field(default_factory=dict)
+    # filled by `TextObervationProcessor.retrieve_viewport_info`,
+    # NaN for rows without a union bound
+    union_bounds: npt.NDArray[np.float64] = field(init=False)
+    _child_ptr: npt.NDArray[np.int64] | None = field(
+        init=False, default=None, repr=False
+    )
+    _child_idx: npt.NDArray[np.int64] | None = field(
+        init=False, default=None, repr=False
+    )
+    _levels: list[npt.NDArray[np.int64]] | None = field(
+        init=False, default=None, repr=False
+    )
+
+    def __post_init__(self) -> None:
+        self.union_bounds = np.full_like(self.bounds, np.nan)
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.parent)
+
+    def _build_children(self) -> None:
+        # CSR layout of the child lists, children keep their document order
+        has_parent = self.parent >= 0
+        child_idx = np.flatnonzero(has_parent)
+        order = np.argsort(self.parent[child_idx], kind="stable")
+        self._child_idx = child_idx[order]
+        counts = np.bincount(self.parent[has_parent], minlength=self.num_nodes)
+        self._child_ptr = np.concatenate(([0], np.cumsum(counts)))
+
+    def children(self, idx: int) -> npt.NDArray[np.int64]:
+        """Return the child node indices of node `idx` in document order"""
+        if self._child_ptr is None:
+            self._build_children()
+        assert self._child_ptr is not None and self._child_idx is not None
+        return self._child_idx[self._child_ptr[idx] : self._child_ptr[idx + 1]]
+
+    def layout_row(self, idx: int) -> int:
+        """Return the layout row of node `idx`, -1 if it has no layout"""
+        return int(self.node_to_layout[idx])
+
+    def depth(self) -> npt.NDArray[np.int64]:
+        """Return the depth of every node, computed by pointer jumping so
+        that arbitrarily deep documents do not need recursion"""
+        depth = (self.parent >= 0).astype(np.int64)
+        ptr = self.parent.copy()
+        active = ptr >= 0
+        while active.any():
+            up = ptr[active]
+            depth[active] += depth[up]
+            ptr[active] = ptr[up]
+            active = ptr >= 0
+        return depth
+
+    def levels(self) -> list[npt.NDArray[np.int64]]:
+        """Return the node indices grouped by depth, root level first"""
+        if self._levels is None:
+            depth = self.depth()
+            order = np.argsort(depth, kind="stable")
+            level_ptr = np.searchsorted(
+                depth[order], np.arange(depth[order[-1]] + 2)
+            )
+            self._levels = [
+                order[level_ptr[d] : level_ptr[d + 1]]
+                for d in range(len(level_ptr) - 1)
+            ]
+        return self._levels
+
+    def style_mask(self, name: str, value: str) -> npt.NDArray[np.bool_]:
+        """Return the layout rows whose computed style `name` is `value`"""
+        if name not in self.styles or value not in self.strings:
+            return np.zeros(len(self.layout_node_index), dtype=bool)
+        return self.styles[name] == self.strings.index(value)
+
+    def scrolled(self, dx: float, dy: float) -> "DOMSnapshotArrays":
+        """Return the snapshot as it would be captured after scrolling the
+        window by (dx, dy) without any other change to the page.
+
+        Bounds are in document coordinates, so only the subtrees of
+        `position: fixed` elements move with the window. The union bounds
+        have to be recomputed on the returned snapshot.
+        """
+        rows = self.style_mask("position", "fixed")
+        fixed = np.zeros(self.num_nodes, dtype=bool)
+        fixed[self.layout_node_index[rows]] = True
+        for level in self.levels()[1:]:
+            fixed[level] |= fixed[self.parent[level]]
+
+        bounds = self.bounds.copy()
+        moved = fixed[self.layout_node_index]
+        bounds[moved, 0] += dx
+        bounds[moved, 1] += dy
+
+        snapshot = replace(self, bounds=bounds)
+        snapshot._child_ptr = self._child_ptr
+        snapshot._child_idx = self._child_idx
+        snapshot._levels = self._levels
+        return snapshot
+
+    def compute_union_bounds(self) -> None:
+        """Fill `union_bounds` with the union of the valid bounds in the
+        subtree of every node that can be reached from the root through
+        nodes with a layout object.
+
+        A bound is valid when neither its width nor its height is close to
+        zero, and a child contributes its union bound only if that union
+        bound is valid. The result is reduced level by level from the
+        deepest nodes up: each level scatters its absolute [x0, y0, x1, y1]
+        boxes into the parents with a min/max reduction.
+        """
+        num_nodes = self.num_nodes
+        self.union_bounds = np.full_like(self.bounds, np.nan)
+        if num_nodes == 0 or self.node_to_layout[0] < 0:
+            return
+
+        levels = self.levels()
+
+        # nodes reached by the traversal from the root
+        has_layout = self.node_to_layout >= 0
+        reached = np.zeros(num_nodes, dtype=bool)
+        reached[0] = True
+        for level in levels[1:]:
+            reached[level] = has_layout[level] & reached[self.parent[level]]
+
+        # own bounds in absolute coordinates
+        rows = self.node_to_layout
+        x0 = np.full(num_nodes, np.inf)
+        y0 = np.full(num_nodes, np.inf)
+        x1 = np.full(num_nodes, -np.inf)
+        y1 = np.full(num_nodes, -np.inf)
+        idx = np.flatnonzero(reached)
+        own = self.bounds[rows[idx]]
+        valid = ~np.isclose(own[:, 2], 0) & ~np.isclose(own[:, 3], 0)
+        idx, own = idx[valid], own[valid]
+        x0[idx] = own[:, 0]
+        y0[idx] = own[:, 1]
+        x1[idx] = own[:, 0] + own[:, 2]
+        y1[idx] = own[:, 1] + own[:, 3]
+
+        for level in reversed(levels):
+            level = level[reached[level]]
+            if len(level) == 0:
+                continue
+            empty = np.isinf(x0[level])
+            union = np.stack(
+                [
+                    x0[level],
+                    y0[level],
+                    x1[level] - x0[level],
+                    y1[level] - y0[level],
+                ],
+                axis=1,
+            )
+            union[empty] = 0.0
+            self.union_bounds[rows[level]] = union
+
+            # propagate the valid union bounds to the parents
+            valid = (
+                ~np.isclose(union[:, 2], 0)
+                & ~np.isclose(union[:, 3], 0)
+                & (self.parent[level] >= 0)
+            )
+            parents = self.parent[level[valid]]
+            union = union[valid]
+            np.minimum.at(x0, parents, union[:, 0])
+            np.minimum.at(y0, parents, union[:, 1])
+            np.maximum.at(x1, parents, union[:, 0] + union[:, 2])
+            np.maximum.at(y1, parents, union[:, 1] + union[:, 3])
+
+
+def decode_dom_snapshot(
+    tree: dict[str, Any],
+    viewport_width: float,
+    computed_styles: list[str] = [],
+) -> DOMSnapshotArrays:
+    """Decode the first document of a `DOMSnapshot.captureSnapshot` result.
+
+    The bounds are calibrated against the viewport width, in some cases the
+    bounds are scaled somehow. `computed_styles` is the list of styles the
+    snapshot was captured with.
+    """
+    document = tree["documents"][0]
+    nodes = document["nodes"]
+    layout = document["layout"]
+
+    parent = np.asarray(nodes["parentIndex"], dtype=np.int64)
+    layout_node_index = np.asarray(layout["nodeIndex"], dtype=np.int64)
+    bounds = np.asarray(layout["bounds"], dtype=np.float64).reshape(-1, 4)
+    if len(bounds):
+        n = bounds[0, 2] / viewport_width
+        bounds = bounds / n
+
+    # a node can own several layout objects, keep the first one
+    node_to_layout = np.full(len(parent), -1, dtype=np.int64)
+    layout_nodes, first_rows = np.unique(layout_node_index, return_index=True)
+    node_to_layout[layout_nodes] = first_rows
+
+    styles = {}
+    if computed_styles:
+        style_idx = np.full(
+            (len(layout_node_index), len(computed_styles)), -1, dtype=np.int64
+        )
+        for row, row_styles in enumerate(layout.get("styles", [])):
+            style_idx[row, : len(row_styles)] = row_styles
+        styles = {
+            name: style_idx[:, i] for i, name in enumerate(computed_styles)
+        }
+
+    return DOMSnapshotArrays(
+        strings=tree["strings"],
+        parent=parent,
+        node_name=np.asarray(nodes["nodeName"], dtype=np.int64),
+        node_value=np.asarray(
+            nodes.get("nodeValue", [-1] * len(parent)), dtype=np.int64
+        ),
+        backend_node_id=np.asarray(nodes["backendNodeId"], dtype=np.int64),
+        attributes=nodes["attributes"],
+        node_to_layout=node_to_layout,
+        layout_node_index=layout_node_index,
+        bounds=bounds,
+        offset_rects=layout["offsetRects"],
+        styles=styles,
+    )
@@ -1,17 +1,66 @@
-from dataclasses import dataclass
+import zlib
 from io import BytesIO
-from typing import Any, Dict, TypedDict, Union
+from typing import Any, Callable, Dict, TypedDict, Union
 
 import numpy as np
 import numpy.typing as npt
 from beartype import beartype
 from PIL import Image
 
+from .snapshot import DOMSnapshotArrays
+
 
-@dataclass
 class DetachedPage:
-    url: str
-    content: str  # html
+    """The url and the html of the page at one step.
+
+    The html is stored zlib compressed. When `content` is given as a
+    function, it is only called the first time the html is read. Like the
+    deferred observations, the html then describes the page at the step
+    that produced it, so reading it for the first time after `expire`
+    raises.
+    """
+
+    def __init__(self, url: str, content: str | Callable[[], str]) -> None:
+        self.url = url
+        self.expired = False
+        self._capture: Callable[[], str] | None = None
+        self._content: bytes | None = None
+        if callable(content):
+            self._capture = content
+        else:
+            self._content = zlib.compress(content.encode())
+
+    @property
+    def content(self) -> str:  # html
+        if self._content is None:
+            if self._capture is None or self.expired:
+                raise RuntimeError(
+                    "The page content was not read before the next step,"
+                    " use the eager page content mode to always capture it"
+                )
+            self._content = zlib.compress(self._capture().encode())
+            self._capture = None
+        return zlib.decompress(self._content).decode()
+
+    def expire(self) -> None:
+        self.expired = True
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, DetachedPage):
+            return NotImplemented
+        return self.url == other.url and self.content == other.content
+
+    def __repr__(self) -> str:
+        return f"DetachedPage(url={self.url!r})"
+
+    def __getstate__(self) -> dict[str, Any]:
+        # the capture function holds the live page
+        return {
+            "url": self.url,
+            "expired": True,
+            "_capture": None,
+            "_content": self._content,
+        }
 
 
 @beartype
@@ -40,6 +89,8 @@ class AccessibilityTreeNode(TypedDict):
     bound: list[float] | None
     union_bound: list[float] | None
     offsetrect_bound: list[float] | None
+    # the id shown in the observation, see `StableElementIds`
+    elementId: str
 
 
 class BrowserConfig(TypedDict):
@@ -53,8 +104,12 @@ class BrowserConfig(TypedDict):
 
 
 class BrowserInfo(TypedDict):
-    DOMTree: dict[str, Any]
+    # the raw DOMSnapshot.captureSnapshot answer is only kept decoded, the
+    # arrays are much cheaper to keep and to send to a worker
+    snapshot: DOMSnapshotArrays
     config: BrowserConfig
+    # None when the title of one of the open tabs could not be read
+    tab_titles: list[str] | None
 
 
 AccessibilityTree = list[AccessibilityTreeNode]
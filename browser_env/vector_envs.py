@@ -0,0 +1,436 @@
+"""Step several `ScriptBrowserEnv` in parallel, one per worker process.
+
+Every worker owns a sync Playwright env with its own browser. The driver
+sends the commands of all the workers before waiting for any answer, so
+the browsers load their pages and serialize their observations at the
+same time. `gymnasium.vector.AsyncVectorEnv` can not be used because the
+actions and the step infos are not members of the env spaces.
+
+The screenshots can be written by the workers into a ring of
+`multiprocessing.shared_memory` slots instead of being pickled through the
+pipes, a 1280x720 screenshot is 2.7 MB per env and step.
+"""
+import multiprocessing as mp
+import traceback
+from collections import deque
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Sequence
+
+import numpy as np
+import numpy.typing as npt
+from beartype import beartype
+from gymnasium import spaces
+from gymnasium.vector import AutoresetMode, VectorEnv
+from gymnasium.vector.utils import (
+    CloudpickleWrapper,
+    batch_space,
+    concatenate,
+    create_empty_array,
+)
+
+from .actions import Action, ActionTypes
+from .envs import ScriptBrowserEnv
+from .utils import DetachedPage, Observation
+
+
+def _worker(
+    env_fn: CloudpickleWrapper,
+    pipe: Connection,
+    parent_pipe: Connection,
+    observation_keys: list[str],
+    index: int,
+    shared_buffers: dict[str, tuple[str, tuple[int, ...], str]],
+) -> None:
+    parent_pipe.close()
+    env: ScriptBrowserEnv = env_fn()
+    shared_memory = {
+        key: SharedMemory(name=name)
+        for key, (name, _, _) in shared_buffers.items()
+    }
+    # (slot, env, *shape) views of the shared memory
+    buffers = {
+        key: np.ndarray(shape, dtype=dtype, buffer=shared_memory[key].buf)
+        for key, (_, shape, dtype) in shared_buffers.items()
+    }
+
+    def select(
+        obs: dict[str, Observation], slot: int
+    ) -> dict[str, Observation | None]:
+        # reading a lazy entry captures it before the page changes
+        selected: dict[str, Observation | None] = {}
+        for key in observation_keys:
+            if key in buffers:
+                np.copyto(buffers[key][slot, index], obs[key])
+                selected[key] = None
+            else:
+                selected[key] = obs[key]
+        return selected
+
+    def detach(info: dict[str, Any]) -> dict[str, Any]:
+        # a lazy page can not be captured once it left the worker, the
+        # html is serialized here, in parallel with the other workers
+        page = info.get("page")
+        if isinstance(page, DetachedPage):
+            page.content
+        return info
+
+    try:
+        while True:
+            command, data, slot = pipe.recv()
+            try:
+                if command == "reset":
+                    obs, info = env.reset(**data)
+                    result: Any = (select(obs, slot), detach(info))
+                elif command == "step":
+                    obs, reward, terminated, truncated, info = env.step(data)
+                    result = (
+                        select(obs, slot),
+                        reward,
+                        terminated,
+                        truncated,
+                        detach(info),
+                    )
+                elif command == "call":
+                    name, args, kwargs = data
+                    attr = getattr(env, name)
+                    result = attr(*args, **kwargs) if callable(attr) else attr
+                elif command == "close":
+                    pipe.send((None, True))
+                    break
+                else:
+                    raise ValueError(f"Unknown command: {command}")
+            except Exception:
+                # Playwright errors do not always survive pickling
+                pipe.send((traceback.format_exc(), False))
+            else:
+                pipe.send((result, True))
+    finally:
+        env.close()
+        for block in shared_memory.values():
+            block.close()
+
+
+class ScriptBrowserVectorEnv(VectorEnv):  # type: ignore[type-arg]
+    """Vectorized `ScriptBrowserEnv` following gymnasium's vector API.
+
+    `reset(options={"config_file": [...]})` starts one task per env, the
+    config files after the first `num_envs` are queued. An episode ends
+    with the stop action, or is truncated after `max_episode_steps`, and
+    the env is reset to the next queued task on its next step, whose
+    action is ignored. An env without a queued task is reset to a blank
+    page. `info["config_file"]` holds the task of every env, empty for a
+    blank page.
+
+    The actions are a sequence of `Action`, one per env. Only the
+    `observation_keys` entries of the observations are sent back, so a
+    text agent does not pay for the screenshots of a lazy image
+    observation. They default to every entry but the image when the
+    main observation is text. The html of `info["page"]` is always captured by the
+    workers, whatever the `page_content_mode` of the envs.
+
+    With `shared_memory_slots`, the image observations of a step are
+    written by the workers into one of that many shared slots, used in
+    turn, and only the slot travels over the pipes. The returned image
+    arrays are views of the slot, they are overwritten by the
+    `shared_memory_slots`-th next reset or step and must be copied to be
+    kept longer.
+    """
+
+    metadata = {"autoreset_mode": AutoresetMode.NEXT_STEP}
+
+    @beartype
+    def __init__(
+        self,
+        env_fns: Sequence[Callable[[], ScriptBrowserEnv]],
+        observation_keys: list[str] | None = None,
+        max_episode_steps: int = 0,
+        shared_memory_slots: int = 0,
+        context: str = "spawn",
+    ) -> None:
+        if not env_fns:
+            raise ValueError("At least one env is needed")
+        if max_episode_steps < 0:
+            raise ValueError("The episode step limit can not be negative")
+        if shared_memory_slots < 0:
+            raise ValueError("The number of slots can not be negative")
+        self.num_envs = len(env_fns)
+        self.max_episode_steps = max_episode_steps
+
+        # the env only launches its browser on reset
+        env = env_fns[0]()
+        observation_space = env.observation_space
+        self.single_action_space = env.action_space
+        env.close()
+        if observation_keys is None:
+            # a text agent does not read the screenshots
+            observation_keys = [
+                key
+                for key in observation_space.keys()
+                if key != "image" or env.main_observation_type == "image"
+            ]
+        for key in observation_keys:
+            if key not in observation_space.keys():
+                raise ValueError(f"Unknown observation key: {key}")
+        self.observation_keys = observation_keys
+        self.single_observation_space = spaces.Dict(
+            {key: observation_space[key] for key in observation_keys}
+        )
+        self.observation_space = batch_space(
+            self.single_observation_space, self.num_envs
+        )
+        self.action_space = batch_space(
+            self.single_action_space, self.num_envs
+        )
+
+        # the images go through shared memory, the rest through the pipes
+        shared_keys = [
+            key
+            for key in observation_keys
+            if shared_memory_slots > 0
+            and isinstance(observation_space[key], spaces.Box)
+        ]
+        self.pipe_observation_space = spaces.Dict(
+            {
+                key: observation_space[key]
+                for key in observation_keys
+                if key not in shared_keys
+            }
+        )
+        self.shared_memory: dict[str, SharedMemory] = {}
+        self.shared_buffers: dict[str, npt.NDArray[Any]] = {}
+        shared_buffers = {}
+        for key in shared_keys:
+            space = observation_space[key]
+            shape = (shared_memory_slots, self.num_envs, *space.shape)
+            size = int(np.prod(shape)) * space.dtype.itemsize
+            block = SharedMemory(create=True, size=size)
+            self.shared_memory[key] = block
+            self.shared_buffers[key] = np.ndarray(
+                shape, dtype=space.dtype, buffer=block.buf
+            )
+            shared_buffers[key] = (block.name, shape, space.dtype.str)
+        self.shared_memory_slots = shared_memory_slots
+        self.slot = 0
+
+        self.config_files: list[str] = [""] * self.num_envs
+        self.queued_config_files: deque[str] = deque()
+        self.episode_steps = np.zeros(self.num_envs, dtype=np.int64)
+        self.autoreset_envs = np.zeros(self.num_envs, dtype=np.bool_)
+        self.stopping = np.zeros(self.num_envs, dtype=np.bool_)
+        self.waiting = ""
+
+        ctx = mp.get_context(context)
+        self.parent_pipes: list[Connection] = []
+        self.processes = []
+        for index, env_fn in enumerate(env_fns):
+            parent_pipe, child_pipe = ctx.Pipe()
+            process = ctx.Process(
+                target=_worker,
+                args=(
+                    CloudpickleWrapper(env_fn),
+                    child_pipe,
+                    parent_pipe,
+                    observation_keys,
+                    index,
+                    shared_buffers,
+                ),
+                daemon=True,
+            )
+            self.parent_pipes.append(parent_pipe)
+            self.processes.append(process)
+            process.start()
+            child_pipe.close()
+
+    def _receive_all(self) -> list[Any]:
+        """Wait for the answer of every env, all of them are read before
+        the failure of one is raised"""
+        answers = [pipe.recv() for pipe in self.parent_pipes]
+        self.waiting = ""
+        for index, (result, success) in enumerate(answers):
+            if not success:
+                raise RuntimeError(f"Env {index} failed:\n{result}")
+        return [result for result, _ in answers]
+
+    def _send_reset(self, index: int, seed: int | None) -> None:
+        if self.queued_config_files:
+            config_file = self.queued_config_files.popleft()
+            options = {"config_file": config_file}
+        else:
+            config_file, options = "", None
+        self.config_files[index] = config_file
+        self.episode_steps[index] = 0
+        self.parent_pipes[index].send(
+            ("reset", {"seed": seed, "options": options}, self.slot)
+        )
+
+    def _next_slot(self) -> None:
+        if self.shared_memory_slots > 0:
+            self.slot = (self.slot + 1) % self.shared_memory_slots
+
+    def _batch(
+        self, observations: list[dict[str, Observation | None]]
+    ) -> dict[str, Any]:
+        out = create_empty_array(
+            self.pipe_observation_space, n=self.num_envs, fn=np.zeros
+        )
+        batched = concatenate(
+            self.pipe_observation_space,
+            [
+                {key: obs[key] for key in self.pipe_observation_space}
+                for obs in observations
+            ],
+            out,
+        )
+        return {
+            key: self.shared_buffers[key][self.slot]
+            if key in self.shared_buffers
+            else batched[key]
+            for key in self.observation_keys
+        }
+
+    def _batch_infos(self, infos: list[dict[str, Any]]) -> dict[str, Any]:
+        batched: dict[str, Any] = {}
+        for index, info in enumerate(infos):
+            info = {**info, "config_file": self.config_files[index]}
+            batched = self._add_info(batched, info, index)
+        return batched
+
+    @beartype
+    def reset_async(
+        self,
+        seed: int | list[int | None] | None = None,
+        options: dict[str, Any] | None = None,
+    ) -> None:
+        if self.waiting:
+            raise RuntimeError(f"Still waiting for {self.waiting}")
+        if seed is None or isinstance(seed, int):
+            seeds = [
+                None if seed is None else seed + index
+                for index in range(self.num_envs)
+            ]
+        else:
+            seeds = seed
+        if len(seeds) != self.num_envs:
+            raise ValueError(f"Expected {self.num_envs} seeds")
+
+        config_files = (options or {}).get("config_file", [])
+        if isinstance(config_files, str):
+            config_files = [config_files]
+        self.queued_config_files = deque(str(f) for f in config_files)
+        self.autoreset_envs[:] = False
+        self._next_slot()
+        for index in range(self.num_envs):
+            self._send_reset(index, seeds[index])
+        self.waiting = "reset"
+
+    def reset_wait(self) -> tuple[dict[str, Any], dict[str, Any]]:
+        if self.waiting != "reset":
+            raise RuntimeError("Call reset_async first")
+        results = self._receive_all()
+        observations, infos = zip(*results)
+        return self._batch(list(observations)), self._batch_infos(list(infos))
+
+    def reset(
+        self,
+        *,
+        seed: int | list[int | None] | None = None,
+        options: dict[str, Any] | None = None,
+    ) -> tuple[dict[str, Any], dict[str, Any]]:
+        self.reset_async(seed=seed, options=options)
+        return self.reset_wait()
+
+    @beartype
+    def step_async(self, actions: Sequence[Action]) -> None:
+        if self.waiting:
+            raise RuntimeError(f"Still waiting for {self.waiting}")
+        if len(actions) != self.num_envs:
+            raise ValueError(f"Expected {self.num_envs} actions")
+        self._next_slot()
+        for index, action in enumerate(actions):
+            if self.autoreset_envs[index]:
+                self._send_reset(index, None)
+            else:
+                self.episode_steps[index] += 1
+                self.parent_pipes[index].send(("step", action, self.slot))
+        self.stopping = np.array(
+            [action["action_type"] == ActionTypes.STOP for action in actions]
+        )
+        self.waiting = "step"
+
+    def step_wait(
+        self,
+    ) -> tuple[
+        dict[str, Any],
+        npt.NDArray[np.float64],
+        npt.NDArray[np.bool_],
+        npt.NDArray[np.bool_],
+        dict[str, Any],
+    ]:
+        if self.waiting != "step":
+            raise RuntimeError("Call step_async first")
+        observations = []
+        rewards = np.zeros(self.num_envs, dtype=np.float64)
+        terminations = np.zeros(self.num_envs, dtype=np.bool_)
+        truncations = np.zeros(self.num_envs, dtype=np.bool_)
+        infos = []
+        for index, result in enumerate(self._receive_all()):
+            if self.autoreset_envs[index]:
+                obs, info = result
+            else:
+                obs, reward, terminated, truncated, info = result
+                rewards[index] = reward
+                terminations[index] = terminated or self.stopping[index]
+                truncations[index] = truncated or (
+                    self.max_episode_steps > 0
+                    and self.episode_steps[index] >= self.max_episode_steps
+                )
+            observations.append(obs)
+            infos.append(info)
+        # the envs that just finished are reset on their next step
+        self.autoreset_envs = terminations | truncations
+        return (
+            self._batch(observations),
+            rewards,
+            terminations,
+            truncations,
+            self._batch_infos(infos),
+        )
+
+    def step(
+        self, actions: Sequence[Action]
+    ) -> tuple[
+        dict[str, Any],
+        npt.NDArray[np.float64],
+        npt.NDArray[np.bool_],
+        npt.NDArray[np.bool_],
+        dict[str, Any],
+    ]:
+        self.step_async(actions)
+        return self.step_wait()
+
+    def call(self, name: str, *args: Any, **kwargs: Any) -> tuple[Any, ...]:
+        """Call the method `name` of every env, or read the attribute"""
+        if self.waiting:
+            raise RuntimeError(f"Still waiting for {self.waiting}")
+        for pipe in self.parent_pipes:
+            pipe.send(("call", (name, args, kwargs), None))
+        return tuple(self._receive_all())
+
+    def get_attr(self, name: str) -> tuple[Any, ...]:
+        return self.call(name)
+
+    def close_extras(self, **kwargs: Any) -> None:
+        for pipe in self.parent_pipes:
+            if self.waiting:
+                # drop the answer of the command in flight
+                pipe.recv()
+            pipe.send(("close", None, None))
+        for pipe in self.parent_pipes:
+            pipe.recv()
+            pipe.close()
+        for process in self.processes:
+            process.join()
+        for block in self.shared_memory.values():
+            block.close()
+            block.unlink()
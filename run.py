@@ -27,6 +27,7 @@ from browser_env import (
     create_stop_action,
 )
 from browser_env.actions import is_equivalent
+from browser_env.constants import RESOURCE_BLOCKING_PROFILES
 from browser_env.helper_functions import (
     RenderHelper,
     get_action_description,
@@ -83,7 +84,78 @@ def config() -> argparse.Namespace:
     )
     parser.add_argument("--viewport_width", type=int, default=1280)
     parser.add_argument("--viewport_height", type=int, default=720)
+    parser.add_argument(
+        "--text_observation_backend",
+        choices=["cdp", "page_script"],
+        default="cdp",
+        help="Build the accessibility tree from CDP or with a script inside the page",
+    )
+    parser.add_argument(
+        "--image_observation_mode",
+        choices=["auto", "lazy", "eager"],
+        default="auto",
+        help="When to take the screenshot, lazy only takes it when the image observation is read",
+    )
     parser.add_argument("--save_trace_enabled", action="store_true")
+    parser.add_argument(
+        "--incremental_accessibility_tree",
+        action="store_true",
+        help="Patch the accessibility tree with the CDP update events instead of fetching it on every step",
+    )
+    parser.add_argument(
+        "--page_content_mode",
+        choices=["lazy", "eager"],
+        default="lazy",
+        help="When to serialize the html of the page kept in the step info, lazy only does it when it is read",
+    )
+    parser.add_argument(
+        "--stable_element_ids",
+        action="store_true",
+        help="Keep the element id of a DOM node across steps so that unchanged parts of the observation stay identical",
+    )
+    parser.add_argument(
+        "--delta_keyframe_interval",
+        type=int,
+        default=0,
+        help="Only send the changes of the accessibility tree since the previous step, with the full tree every this many steps, needs --stable_element_ids and a delta prompt",
+    )
+    parser.add_argument(
+        "--collapse_repeated_subtrees",
+        action="store_true",
+        help="Collapse the parts of the accessibility tree already shown in this episode, they are shown again with the expand action, needs --stable_element_ids",
+    )
+    parser.add_argument(
+        "--extra_text_observation_types",
+        nargs="*",
+        choices=["accessibility_tree", "html"],
+        default=[],
+        help="Other text representations to build from the same page capture, stored under their type in the observation",
+    )
+    parser.add_argument(
+        "--resource_blocking",
+        choices=list(RESOURCE_BLOCKING_PROFILES),
+        default="none",
+        help="Skip the images, media and fonts that text observations do not need",
+    )
+    parser.add_argument(
+        "--observation_workers",
+        type=int,
+        default=0,
+        help="Serialize the text observations in a pool of this many processes, "
+        "only faster with --page_content_mode eager or image observations",
+    )
+    parser.add_argument(
+        "--prefetch_contexts",
+        type=int,
+        default=0,
+        help="Open the browser contexts of this many upcoming tasks while the current one runs",
+    )
+    parser.add_argument(
+        "--prefetch_memory_limit_mb",
+        type=int,
+        default=0,
+        help="Close the oldest prefetched contexts when their pages use more JavaScript heap than this, 0 for no limit",
+    )
     parser.add_argument("--sleep_after_execution", type=float, default=0.0)
 
     parser.add_argument("--max_steps", type=int, default=30)
@@ -226,9 +298,26 @@ def test(
         },
         save_trace_enabled=args.save_trace_enabled,
         sleep_after_execution=args.sleep_after_execution,
+        # serialize the observation directly under the prompt token budget
+        max_obs_length=args.max_obs_length,
+        tokenizer=agent.prompt_constructor.tokenizer
+        if isinstance(agent, PromptAgent)
+        else None,
+        incremental_accessibility_tree=args.incremental_accessibility_tree,
+        image_observation_mode=args.image_observation_mode,
+        text_observation_backend=args.text_observation_backend,
+        observation_workers=args.observation_workers,
+        page_content_mode=args.page_content_mode,
+        resource_blocking=args.resource_blocking,
+        extra_text_observation_types=args.extra_text_observation_types,
+        stable_element_ids=args.stable_element_ids,
+        delta_keyframe_interval=args.delta_keyframe_interval,
+        collapse_repeated_subtrees=args.collapse_repeated_subtrees,
+        prefetch_contexts=args.prefetch_contexts,
+        prefetch_memory_limit_mb=args.prefetch_memory_limit_mb,
     )
 
-    for config_file in config_file_list:
+    for task_idx, config_file in enumerate(config_file_list):
         try:
             render_helper = RenderHelper(
                 config_file, args.result_dir, args.action_set_tag
@@ -246,6 +335,11 @@ def test(
             agent.reset(config_file)
             trajectory: Trajectory = []
             obs, info = env.reset(options={"config_file": config_file})
+            # the next tasks load while the agent works on this one
+            for next_config_file in config_file_list[
+                task_idx + 1 : task_idx + 1 + args.prefetch_contexts
+            ]:
+                env.prefetch(next_config_file)
             state_info: StateInfo = {"observation": obs, "info": info}
             trajectory.append(state_info)
 
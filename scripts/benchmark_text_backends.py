@@ -0,0 +1,47 @@
+"""Compare the observation time of the cdp and page_script text backends"""
+
+import argparse
+import time
+
+from beartype import beartype
+
+from browser_env import ScriptBrowserEnv, create_playwright_action
+
+
+@beartype
+def benchmark(
+    backend: str, urls: list[str], current_viewport_only: bool, repeat: int
+) -> None:
+    env = ScriptBrowserEnv(
+        observation_type="accessibility_tree",
+        current_viewport_only=current_viewport_only,
+        text_observation_backend=backend,
+    )
+    env.reset()
+    for url in urls:
+        obs, *_ = env.step(create_playwright_action(f'page.goto("{url}")'))
+        processor = env.observation_handler.text_processor
+        elapsed = 0.0
+        for _ in range(repeat):
+            # time full extractions, not the answers kept for an unchanged
+            # page
+            processor.observation_memo = None
+            processor.page_cache.clear()
+            start = time.perf_counter()
+            obs = env._get_obs()
+            elapsed += (time.perf_counter() - start) / repeat
+        print(
+            f"{backend:<12} {elapsed * 1000:8.1f} ms"
+            f" {len(obs['text']):8d} chars  {url}"
+        )
+    env.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("urls", nargs="+")
+    parser.add_argument("--current_viewport_only", action="store_true")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    for backend in ["cdp", "page_script"]:
+        benchmark(backend, args.urls, args.current_viewport_only, args.repeat)
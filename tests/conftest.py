@@ -63,6 +63,64 @@ def accessibility_tree_current_viewport_script_browser_env() -> Generator[
     env.close()
 
 
+@pytest.fixture(scope="function")
+def incremental_accessibility_tree_script_browser_env() -> Generator[
+    ScriptBrowserEnv, None, None
+]:
+    env = ScriptBrowserEnv(
+        headless=HEADLESS,
+        slow_mo=SLOW_MO,
+        observation_type="accessibility_tree",
+        incremental_accessibility_tree=True,
+    )
+    yield env
+    env.close()
+
+
+@pytest.fixture(scope="function")
+def page_script_script_browser_env() -> Generator[
+    ScriptBrowserEnv, None, None
+]:
+    env = ScriptBrowserEnv(
+        headless=HEADLESS,
+        slow_mo=SLOW_MO,
+        observation_type="accessibility_tree",
+        current_viewport_only=True,
+        text_observation_backend="page_script",
+    )
+    yield env
+    env.close()
+
+
+@pytest.fixture(scope="function")
+def resource_blocking_script_browser_env() -> Generator[
+    ScriptBrowserEnv, None, None
+]:
+    env = ScriptBrowserEnv(
+        headless=HEADLESS,
+        slow_mo=SLOW_MO,
+        observation_type="accessibility_tree",
+        resource_blocking="text",
+    )
+    yield env
+    env.close()
+
+
+@pytest.fixture(scope="function")
+def extra_text_observations_script_browser_env() -> Generator[
+    ScriptBrowserEnv, None, None
+]:
+    env = ScriptBrowserEnv(
+        headless=HEADLESS,
+        slow_mo=SLOW_MO,
+        observation_type="accessibility_tree",
+        current_viewport_only=True,
+        extra_text_observation_types=["html"],
+    )
+    yield env
+    env.close()
+
+
 @pytest_asyncio.fixture(scope="function", autouse=True)
 async def async_script_browser_env() -> AsyncGenerator[
     AsyncScriptBrowserEnv, None
@@ -0,0 +1,79 @@
+import json
+from pathlib import Path
+from typing import Any
+
+import tiktoken
+
+from agent.prompts.prompt_constructor import PromptConstructor
+from browser_env import create_none_action
+from browser_env.processors import (
+    DELTA_OBSERVATION_MARKER,
+    ObservationHandler,
+)
+from browser_env.utils import StateInfo
+from llms import lm_config
+
+
+def test_compose_observation_skips_truncation_per_state(
+    tmp_path: Path,
+) -> None:
+    # one token per byte keeps the expected truncation easy to compute
+    tokenizer = tiktoken.Encoding(
+        name="bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+    encoded: list[str] = []
+    encode = tokenizer.encode
+
+    def counting_encode(text: str, **kwargs: Any) -> list[int]:
+        encoded.append(text)
+        return encode(text, **kwargs)
+
+    tokenizer.encode = counting_encode  # type: ignore[method-assign]
+
+    instruction_path = tmp_path / "instruction.json"
+    instruction_path.write_text(
+        json.dumps(
+            {
+                "intro": "",
+                "examples": [],
+                "template": "{observation}",
+                "meta_data": {"observation_mode": "delta"},
+            }
+        )
+    )
+    config = lm_config.LMConfig(
+        provider="openai", model="gpt", gen_config={"max_obs_length": 80}
+    )
+    constructor = PromptConstructor(instruction_path, config, tokenizer)
+
+    # the environment serialized both steps under a budget of 100 tokens
+    handler = ObservationHandler(
+        "text",
+        "accessibility_tree",
+        "",
+        False,
+        {"width": 1280, "height": 720},
+    )
+    full = "Tab 0\n\n" + "[1] RootWebArea 'Shop'".ljust(53)
+    delta = "Tab 0\n\n" + DELTA_OBSERVATION_MARKER.ljust(93)
+    states: list[StateInfo] = []
+    for obs in (full, delta):
+        handler.text_processor.meta_data["num_tokens"] = len(obs)
+        states.append(
+            {
+                "observation": {"text": obs},
+                "info": {
+                    "observation_metadata": handler.get_observation_metadata()
+                },
+            }
+        )
+
+    observation = constructor.compose_observation(
+        [states[0], create_none_action(), states[1]]
+    )
+    # only the step longer than the prompt budget is truncated
+    assert observation == f"{full}\n\n{delta[:80]}"
+    assert encoded == [delta]
@@ -76,6 +76,11 @@ def test_is_equivalent() -> None:
                     assert not is_equivalent(action_a, action_b)
                     action_a["answer"] = action_b["answer"]
                 assert is_equivalent(action_a, action_b)
+            case ActionTypes.EXPAND:
+                if action_a["element_id"] != action_b["element_id"]:
+                    assert not is_equivalent(action_a, action_b)
+                    action_a["element_id"] = action_b["element_id"]
+                assert is_equivalent(action_a, action_b)
             case _:
                 assert is_equivalent(action_a, action_b)
 
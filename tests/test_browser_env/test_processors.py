@@ -0,0 +1,516 @@
+import multiprocessing
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, cast
+
+import numpy as np
+import pytest
+import tiktoken
+
+from browser_env.accessibility import (
+    AccessibilityTreeIndex,
+    StableElementIds,
+    compact_accessibility_node,
+)
+from browser_env.processors import (
+    DELTA_OBSERVATION_MARKER,
+    AsyncObservationHandler,
+    LazyObservation,
+    ObservationHandler,
+    ObsNodeInfo,
+    TextObervationProcessor,
+    TextObservationJob,
+    TokenBudget,
+    init_observation_worker,
+    serialize_in_worker,
+    serialize_text_observation,
+)
+from browser_env.snapshot import decode_dom_snapshot
+from browser_env.utils import (
+    AccessibilityTree,
+    BrowserConfig,
+    DetachedPage,
+)
+
+CONFIG: BrowserConfig = {
+    "win_upper_bound": 100.0,
+    "win_left_bound": 0.0,
+    "win_width": 1280.0,
+    "win_height": 720.0,
+    "win_right_bound": 1280.0,
+    "win_lower_bound": 820.0,
+    "device_pixel_ratio": 1.0,
+}
+
+
+def _dom_snapshot() -> dict[str, Any]:
+    # html > body > (div > #text, span), the span has no layout object and
+    # the div owns two layout objects
+    return {
+        "strings": ["HTML", "BODY", "DIV", "#text", "SPAN", "hello"],
+        "documents": [
+            {
+                "nodes": {
+                    "parentIndex": [-1, 0, 1, 2, 1],
+                    "nodeName": [0, 1, 2, 3, 4],
+                    "nodeValue": [-1, -1, -1, 5, -1],
+                    "attributes": [[], [], [], [], []],
+                    "backendNodeId": [10, 11, 12, 13, 14],
+                },
+                "layout": {
+                    "nodeIndex": [0, 1, 2, 3, 2],
+                    "bounds": [
+                        [0, 0, 2560, 1440],
+                        [0, 0, 2560, 1440],
+                        [20, 40, 200, 100],
+                        [20, 40, 100, 20],
+                        [20, 140, 200, 100],
+                    ],
+                    "offsetRects": [[], [], [], [], []],
+                },
+            }
+        ],
+    }
+
+
+def test_decode_dom_snapshot() -> None:
+    snapshot = decode_dom_snapshot(_dom_snapshot(), viewport_width=1280)
+    assert snapshot.num_nodes == 5
+    # bounds are calibrated against the viewport width
+    assert snapshot.bounds[0].tolist() == [0.0, 0.0, 1280.0, 720.0]
+    assert snapshot.bounds[2].tolist() == [10.0, 20.0, 100.0, 50.0]
+    # the first layout row wins, nodes without layout map to -1
+    assert snapshot.node_to_layout.tolist() == [0, 1, 2, 3, -1]
+    assert snapshot.layout_row(4) == -1
+    assert snapshot.children(1).tolist() == [2, 4]
+    assert snapshot.children(3).tolist() == []
+    assert np.isnan(snapshot.union_bounds).all()
+
+
+def test_union_bounds() -> None:
+    snapshot = decode_dom_snapshot(_dom_snapshot(), viewport_width=1280)
+    snapshot.compute_union_bounds()
+    union_bounds = snapshot.union_bounds
+    assert union_bounds[0].tolist() == [0.0, 0.0, 1280.0, 720.0]
+    assert union_bounds[2].tolist() == [10.0, 20.0, 100.0, 50.0]
+    # only the first layout row of a node carries the union bound
+    assert np.isnan(union_bounds[4]).all()
+
+
+def test_union_bounds_deep_document() -> None:
+    depth = 5000
+    tree = {
+        "strings": ["DIV"],
+        "documents": [
+            {
+                "nodes": {
+                    "parentIndex": list(range(-1, depth - 1)),
+                    "nodeName": [0] * depth,
+                    "attributes": [[]] * depth,
+                    "backendNodeId": list(range(depth)),
+                },
+                "layout": {
+                    "nodeIndex": list(range(depth)),
+                    "bounds": [[0, 0, 1280, 10]]
+                    + [[i, 0, 1, 1] for i in range(1, depth)],
+                    "offsetRects": [[]] * depth,
+                },
+            }
+        ],
+    }
+    snapshot = decode_dom_snapshot(tree, viewport_width=1280)
+    snapshot.compute_union_bounds()
+    assert snapshot.union_bounds[0].tolist() == [0.0, 0.0, depth, 10.0]
+    assert snapshot.union_bounds[1].tolist() == [1.0, 0.0, depth - 1, 1.0]
+
+
+def test_in_viewport_mask() -> None:
+    bounds = np.array(
+        [
+            [0.0, 0.0, 10.0, 100.0],  # touches the upper bound
+            [0.0, 0.0, 10.0, 99.0],  # above the viewport
+            [1280.0, 200.0, 10.0, 10.0],  # right of the viewport
+            [500.0, 819.0, 10.0, 10.0],  # partially visible
+            [np.nan] * 4,  # no bound
+        ]
+    )
+    mask = TextObervationProcessor.in_viewport_mask(bounds, CONFIG)
+    assert mask.tolist() == [True, False, False, True, False]
+    for bound, ok in zip(bounds[:4].tolist(), mask):
+        assert (
+            TextObervationProcessor.partially_in_viewport(bound, CONFIG) == ok
+        )
+
+
+def _ax_node(
+    node_id: str, role: str, name: str, child_ids: list[str]
+) -> dict[str, Any]:
+    return {
+        "nodeId": node_id,
+        "role": {"value": role},
+        "name": {"value": name},
+        "childIds": child_ids,
+        "backendDOMNodeId": int(node_id),
+        "bound": [0.0, 0.0, 10.0, 10.0],
+        "union_bound": [0.0, 0.0, 10.0, 10.0],
+        "offsetrect_bound": [],
+    }
+
+
+def test_parse_accessibility_tree() -> None:
+    accessibility_tree = cast(
+        AccessibilityTree,
+        [
+            _ax_node("1", "RootWebArea", "Shop", ["2", "5"]),
+            _ax_node("2", "generic", "", ["3", "4"]),
+            _ax_node("3", "link", "Add to Cart", []),
+            _ax_node("4", "StaticText", "Add to Cart", []),
+            _ax_node("5", "StaticText", "$279.49", []),
+        ],
+    )
+    content, obs_nodes_info = TextObervationProcessor.parse_accessibility_tree(
+        accessibility_tree
+    )
+    # the empty generic node is skipped without indenting its children and
+    # the repeated static text is removed
+    assert content == (
+        "[1] RootWebArea 'Shop'\n"
+        "\t[3] link 'Add to Cart'\n"
+        "\t[5] StaticText '$279.49'"
+    )
+    assert TextObervationProcessor.clean_accesibility_tree(content) == content
+    assert set(obs_nodes_info) == {"1", "3", "4", "5"}
+    assert obs_nodes_info["3"]["text"] == "[3] link 'Add to Cart'"
+
+
+def test_parse_accessibility_tree_token_budget() -> None:
+    # one token per byte keeps the expected truncation easy to compute
+    tokenizer = tiktoken.Encoding(
+        name="bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+    accessibility_tree = cast(
+        AccessibilityTree,
+        [
+            _ax_node("1", "RootWebArea", "Shop", ["2", "3"]),
+            _ax_node("2", "link", "Add to Cart", []),
+            _ax_node("3", "StaticText", "$279.49", []),
+        ],
+    )
+    full, _ = TextObervationProcessor.parse_accessibility_tree(
+        accessibility_tree
+    )
+    budget = TokenBudget(tokenizer, max_tokens=30)
+    content, obs_nodes_info = TextObervationProcessor.parse_accessibility_tree(
+        accessibility_tree, budget
+    )
+    assert content == full[:30]
+    assert budget.used == 30 and budget.exhausted
+    # the walk stops once the budget is exhausted
+    assert set(obs_nodes_info) == {"1", "2"}
+
+
+def test_scrolled_snapshot_moves_fixed_subtrees() -> None:
+    tree = _dom_snapshot()
+    tree["strings"] += ["static", "fixed"]
+    # the div is fixed, its text moves with it, the body does not
+    tree["documents"][0]["layout"]["styles"] = [[6], [6], [7], [6], [7]]
+    snapshot = decode_dom_snapshot(
+        tree, viewport_width=1280, computed_styles=["position"]
+    )
+    assert snapshot.style_mask("position", "fixed").tolist() == [
+        False,
+        False,
+        True,
+        False,
+        True,
+    ]
+    assert not snapshot.style_mask("position", "sticky").any()
+
+    scrolled = snapshot.scrolled(0.0, 300.0)
+    assert scrolled.bounds[:, 1].tolist() == [0.0, 0.0, 320.0, 320.0, 370.0]
+    # the cached snapshot is left untouched
+    assert snapshot.bounds[:, 1].tolist() == [0.0, 0.0, 20.0, 20.0, 70.0]
+
+
+def test_lazy_observation() -> None:
+    captures = []
+
+    def screenshot() -> np.ndarray:
+        captures.append(1)
+        return np.zeros((720, 1280, 3), dtype=np.uint8)
+
+    obs = LazyObservation({"text": "Tab 0"}, {"image": screenshot})
+    assert "image" in obs and list(obs) == ["text", "image"]
+    assert obs["text"] == "Tab 0" and not captures
+    assert obs["image"].shape == (720, 1280, 3)
+    assert obs["image"] is obs["image"] and len(captures) == 1
+
+    # pickling captures the deferred entries into a plain dict
+    obs = LazyObservation({"text": "Tab 0"}, {"image": screenshot})
+    unpickled = pickle.loads(pickle.dumps(obs))
+    assert type(unpickled) is dict and set(unpickled) == {"text", "image"}
+
+    obs = LazyObservation({"text": "Tab 0"}, {"image": screenshot})
+    obs.expire()
+    assert obs["text"] == "Tab 0"
+    with pytest.raises(RuntimeError):
+        obs["image"]
+
+
+def test_accessibility_tree_index() -> None:
+    nodes = [
+        _ax_node("1", "RootWebArea", "Shop", ["2"]),
+        _ax_node("2", "generic", "", ["3", "missing"]),
+        _ax_node("3", "generic", "", ["4"]),
+        _ax_node("4", "link", "Home", []),
+    ]
+    for child, parent in [("2", "1"), ("3", "2"), ("4", "3")]:
+        nodes[int(child) - 1]["parentId"] = parent
+    nodes[1]["union_bound"] = None
+    nodes[2]["union_bound"] = None
+    index = AccessibilityTreeIndex(cast(AccessibilityTree, nodes))
+    assert index.row["3"] == 2 and index.backend_row[4] == 3
+    assert index.parent.tolist() == [-1, 0, 1, 2]
+    assert index.children[1] == [2]
+    assert np.isnan(index.union_bounds[1]).all()
+
+    # the chain above the link is walked once and memoized for every row
+    assert index.ancestor_with_bound(3) == 0
+    assert index.ancestor_with_bound(2) == 0
+    assert index.ancestor_with_bound(0) == -1
+
+    subset = index.select(np.array([True, False, True, True]))
+    assert [node["nodeId"] for node in subset.nodes] == ["1", "3", "4"]
+    assert subset.children[0] == [] and subset.parent.tolist() == [-1, -1, 1]
+
+
+def test_compact_obs_nodes_info() -> None:
+    node = cast(
+        Any,
+        {
+            "nodeId": "7",
+            "ignored": False,
+            "ignoredReasons": [{"name": "uninteresting"}],
+            "role": {"type": "role", "value": "button"},
+            "chromeRole": {"type": "internalRole", "value": 9},
+            "name": {
+                "type": "computedString",
+                "value": "Submit",
+                "sources": [{"type": "contents"}],
+            },
+            "childIds": [],
+        },
+    )
+    other = cast(Any, {"nodeId": "8", "role": {"value": "button"}})
+    node = compact_accessibility_node(node)
+    assert node["name"] == {"value": "Submit"}
+    assert "ignoredReasons" not in node and "chromeRole" not in node
+    assert node["role"] is compact_accessibility_node(other)["role"]
+
+    info = ObsNodeInfo(
+        7, [0.0, 0.0, 1.0, 1.0], None, [], "[7] button 'Submit'"
+    )
+    assert info["text"] == "[7] button 'Submit'" and "bound" in info
+    assert not hasattr(info, "__dict__")
+    assert pickle.loads(pickle.dumps(info)) == info
+    with pytest.raises(KeyError):
+        info["role"]
+
+
+def test_serialize_text_observations_in_worker() -> None:
+    snapshot = decode_dom_snapshot(_dom_snapshot(), viewport_width=1280)
+    accessibility_tree = cast(
+        AccessibilityTree,
+        [
+            _ax_node("10", "RootWebArea", "Shop", ["12"]),
+            _ax_node("12", "link", "Add to Cart", ["13"]),
+            _ax_node("13", "StaticText", "hello", []),
+        ],
+    )
+    job = TextObservationJob(
+        observation_types=["accessibility_tree", "html"],
+        current_viewport_only=True,
+        info={
+            "snapshot": snapshot,
+            "config": {
+                **CONFIG,
+                "win_upper_bound": 0.0,
+                "win_lower_bound": 720.0,
+            },
+        },
+        accessibility_tree=accessibility_tree,
+        page_content=None,
+        header="Tab 0 (current): Shop",
+        max_obs_length=0,
+    )
+    with ProcessPoolExecutor(
+        1,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_observation_worker,
+        initargs=(None,),
+    ) as executor:
+        in_worker = executor.submit(serialize_in_worker, job).result()
+    result = serialize_text_observation(job, None)
+    assert in_worker == result
+    assert result.content.startswith(
+        "Tab 0 (current): Shop\n\n[10] RootWebArea"
+    )
+    assert set(result.obs_nodes_info) == {"10", "12", "13"}
+    assert result.num_tokens is None
+    # the html is built from the same snapshot
+    assert result.extra["html"] == (
+        "Tab 0 (current): Shop\n\n<html ><body ><div >hello</div></body></html>"
+    )
+
+
+def test_detached_page_content() -> None:
+    captures = []
+
+    def capture() -> str:
+        captures.append(1)
+        return "<html>hello</html>"
+
+    page = DetachedPage("http://example.com", capture)
+    assert not captures
+    assert page.content == "<html>hello</html>"
+    assert page.content == "<html>hello</html>" and len(captures) == 1
+    # pickled without the capture function, which holds the live page
+    copy = pickle.loads(pickle.dumps(page))
+    assert copy == page == DetachedPage("http://example.com", page.content)
+
+    expired = DetachedPage("http://example.com", capture)
+    expired.expire()
+    with pytest.raises(RuntimeError):
+        expired.content
+
+
+def test_stable_element_ids() -> None:
+    def tree(node_ids: list[str]) -> AccessibilityTree:
+        # the same DOM nodes 1, 2 and 3 under new accessibility node ids
+        nodes = [
+            _ax_node(node_ids[0], "RootWebArea", "Shop", node_ids[1:]),
+            _ax_node(node_ids[1], "link", "Add to Cart", []),
+            _ax_node(node_ids[2], "StaticText", "$279.49", []),
+        ]
+        for backend_id, node in enumerate(nodes, start=1):
+            node["backendDOMNodeId"] = backend_id
+        return cast(AccessibilityTree, nodes)
+
+    element_ids = StableElementIds()
+    before, after = tree(["51", "52", "53"]), tree(["90", "91", "92"])
+    element_ids.assign(before)
+    element_ids.assign(after)
+    content, obs_nodes_info = TextObervationProcessor.parse_accessibility_tree(
+        after
+    )
+    assert (
+        content == TextObervationProcessor.parse_accessibility_tree(before)[0]
+    )
+    assert content.startswith("[1] RootWebArea 'Shop'\n\t[2] link")
+    assert set(obs_nodes_info) == {"1", "2", "3"}
+
+
+def test_delta_observation() -> None:
+    processor = TextObervationProcessor(
+        "accessibility_tree",
+        current_viewport_only=True,
+        viewport_size={"width": 1280, "height": 720},
+        stable_element_ids=True,
+        delta_keyframe_interval=3,
+    )
+    items = "".join(f"\n\t[{i}] link 'Product {i}'" for i in range(3, 20))
+    keyframe = f"Tab 0 (current): Shop\n\n[1] RootWebArea 'Shop'{items}"
+    assert processor.delta_observation(keyframe) == keyframe
+
+    changed = keyframe.replace("Product 5'", "Product 5' focused: True")
+    changed = changed.replace("\n\t[7] link 'Product 7'", "")
+    changed += "\n\t[20] button 'Next'"
+    assert processor.delta_observation(changed) == (
+        "Tab 0 (current): Shop\n\n"
+        f"{DELTA_OBSERVATION_MARKER}\n"
+        "added:\n[20] button 'Next' (after [19])\n"
+        "changed:\n[5] link 'Product 5' focused: True\n"
+        "removed:\n[7] link 'Product 7'"
+    )
+    assert processor.delta_observation(changed).endswith(
+        f"{DELTA_OBSERVATION_MARKER} none"
+    )
+    # every third observation is a keyframe
+    assert processor.delta_observation(changed) == changed
+
+
+def test_collapse_repeated_subtrees() -> None:
+    processor = TextObervationProcessor(
+        "accessibility_tree",
+        current_viewport_only=True,
+        viewport_size={"width": 1280, "height": 720},
+        stable_element_ids=True,
+        collapse_repeated_subtrees=True,
+    )
+
+    def menu(first_id: int) -> str:
+        return f"\n\t[{first_id}] navigation 'Menu'" + "".join(
+            f"\n\t\t[{first_id + i}] link 'Section {i}'" for i in range(1, 10)
+        )
+
+    # the same menu gets new ids on the next page
+    first = f"Tab 0 (current): Admin\n\n[1] RootWebArea 'Orders'{menu(2)}"
+    second = f"Tab 0 (current): Admin\n\n[12] RootWebArea 'Sales'{menu(13)}"
+    assert processor.collapse_subtrees(first, "/orders") == first
+    assert processor.collapse_subtrees(second, "/sales") == (
+        "Tab 0 (current): Admin\n\n[12] RootWebArea 'Sales'\n"
+        "\t[13] navigation 'Menu'\n"
+        "\t\t(9 more lines already shown before, expand [13] to show them"
+        " again)"
+    )
+    processor.expand("13")
+    assert processor.collapse_subtrees(second, "/sales") == second
+
+
+def test_collapse_keeps_the_current_page() -> None:
+    processor = TextObervationProcessor(
+        "accessibility_tree",
+        current_viewport_only=True,
+        viewport_size={"width": 1280, "height": 720},
+        stable_element_ids=True,
+        collapse_repeated_subtrees=True,
+    )
+    results = (
+        "Tab 0 (current): Search\n\n[1] RootWebArea 'Results'\n\t[2] main ''"
+    )
+    results += "".join(f"\n\t\t[{i}] link 'Result {i}'" for i in range(3, 15))
+    # e.g. the same page after a failed click, a scroll or typing
+    assert processor.collapse_subtrees(results, "/search") == results
+    assert processor.collapse_subtrees(results, "/search") == results
+
+
+def test_observation_metadata_is_copied() -> None:
+    handler = ObservationHandler(
+        "text",
+        "accessibility_tree",
+        "",
+        False,
+        {"width": 1280, "height": 720},
+    )
+    handler.text_processor.meta_data["num_tokens"] = 10
+    metadata = handler.get_observation_metadata()
+    handler.text_processor.meta_data["num_tokens"] = 20
+    assert metadata["text"]["num_tokens"] == 10
+    assert handler.get_observation_metadata()["text"]["num_tokens"] == 20
+
+
+def test_async_observation_handler_rejects_lazy_images() -> None:
+    args = (
+        "text",
+        "accessibility_tree",
+        "",
+        False,
+        {"width": 1280, "height": 720},
+    )
+    with pytest.raises(ValueError):
+        AsyncObservationHandler(*args, image_observation_mode="auto")
+    handler = AsyncObservationHandler(*args, image_observation_mode="eager")
+    assert handler.image_observation_mode == "eager"
@@ -1,24 +1,31 @@
 import asyncio
 import collections
 import json
+import re
 import tempfile
+from io import BytesIO
+from pathlib import Path
 from typing import Callable, Dict, Optional, Tuple, Type, Union, cast
 
+import numpy as np
 import pytest
 from beartype.door import is_bearable
 from gymnasium.vector import AsyncVectorEnv
-from playwright.sync_api import Page
+from PIL import Image
+from playwright.sync_api import Page, Route
 
 from browser_env import (
     Action,
     AsyncScriptBrowserEnv,
     DetachedPage,
     ScriptBrowserEnv,
+    ScriptBrowserVectorEnv,
     create_focus_and_click_action,
     create_goto_url_action,
     create_keyboard_type_action,
     create_playwright_action,
     create_scroll_action,
+    create_stop_action,
 )
 from browser_env.actions import create_id_based_action
 from browser_env.env_config import (
@@ -77,6 +84,29 @@ async def test_async_script_browser_env(
     assert info["page"].url == "https://www.rfc-editor.org/rfc/rfc2606.html"
 
 
+@pytest.mark.asyncio
+async def test_async_accessibility_tree_element_id_actions() -> None:
+    env = AsyncScriptBrowserEnv(
+        observation_type="accessibility_tree", save_trace_enabled=True
+    )
+    await env.areset()
+    obs, *_ = await env.astep(create_goto_url_action("http://www.example.com"))
+    assert "RootWebArea 'Example Domain'" in obs["text"]
+    assert obs["image"].shape == (720, 1280, 3)
+    element_id = re.search(r"\[(\d+)\] link 'More", obs["text"])
+    assert element_id is not None
+    _, success, _, _, info = await env.astep(
+        create_id_based_action(f"click [{element_id.group(1)}]")
+    )
+    assert success
+    assert info["page"].url != "http://www.example.com/"
+    assert info["observation_metadata"]["text"]["obs_nodes_info"]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        await env.asave_trace(Path(tmpdir) / "trace.zip")
+        assert (Path(tmpdir) / "trace.zip").exists()
+    await env.aclose()
+
+
 def collate_actions(actions: list[Action]) -> dict[str, list[object]]:
     action_dict = collections.defaultdict(list)
     for action in actions:
@@ -85,6 +115,62 @@ def collate_actions(actions: list[Action]) -> dict[str, list[object]]:
     return action_dict
 
 
+def test_script_browser_vector_env() -> None:
+    config_files = []
+    for url in ["http://www.example.com", "https://www.rfc-editor.org"]:
+        temp_config = tempfile.NamedTemporaryFile("w", delete=False)
+        json.dump({"start_url": url}, temp_config)
+        temp_config.close()
+        config_files.append(temp_config.name)
+
+    vector_env = ScriptBrowserVectorEnv(
+        [
+            lambda: ScriptBrowserEnv(observation_type="accessibility_tree"),
+            lambda: ScriptBrowserEnv(observation_type="accessibility_tree"),
+        ],
+        observation_keys=["text"],
+    )
+    assert set(vector_env.observation_space.keys()) == {"text"}
+    obs, info = vector_env.reset(options={"config_file": config_files})
+    assert "Example Domain" in obs["text"][0]
+    assert list(info["config_file"]) == config_files
+
+    _, _, terminated, _, info = vector_env.step(
+        [create_stop_action(""), create_scroll_action("down")]
+    )
+    assert terminated.tolist() == [True, False]
+    # the lazy html of the envs was captured before leaving the workers
+    assert "rfc-editor" in info["page"][1].content
+    # without a queued task the finished env gets a blank page
+    obs, _, terminated, _, info = vector_env.step(
+        [create_scroll_action("down"), create_scroll_action("down")]
+    )
+    assert terminated.tolist() == [False, False]
+    assert list(info["config_file"]) == ["", config_files[1]]
+    assert "Example Domain" not in obs["text"][0]
+    vector_env.close()
+
+
+def test_script_browser_vector_env_shared_memory() -> None:
+    vector_env = ScriptBrowserVectorEnv(
+        [lambda: ScriptBrowserEnv(), lambda: ScriptBrowserEnv()],
+        observation_keys=["text", "image"],
+        shared_memory_slots=2,
+    )
+    obs, _ = vector_env.reset()
+    first_image = obs["image"]
+    obs, *_ = vector_env.step(
+        [create_goto_url_action("http://www.example.com")] * 2
+    )
+    assert obs["image"].shape == (2, 720, 1280, 3)
+    assert (obs["image"][0] == obs["image"][1]).all()
+    assert not (obs["image"][0] == first_image[0]).all()
+    # the slot of the reset is used again
+    obs, *_ = vector_env.step([create_scroll_action("down")] * 2)
+    assert np.shares_memory(obs["image"], first_image)
+    vector_env.close()
+
+
 @pytest.mark.skip(reason="Gym doesn't support self-defined observations")
 def test_parallel_script_browser_env() -> None:
     vector_env = AsyncVectorEnv(
@@ -248,6 +334,33 @@ def test_accessibility_tree_viewport(
     assert s1 not in obs["text"] and s2 in obs["text"] and s3 in obs["text"]
 
 
+def test_scroll_reuses_capture(
+    accessibility_tree_current_viewport_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = accessibility_tree_current_viewport_script_browser_env
+    env.reset()
+    _, success, _, _, _ = env.step(
+        create_playwright_action(
+            'page.goto("https://russmaxdesign.github.io/exercise/")'
+        )
+    )
+    assert success
+    processor = env.observation_handler.text_processor
+    capture = processor.page_cache[env.page.client]  # type: ignore
+
+    obs, success, _, _, _ = env.step(create_scroll_action("down"))
+    assert success
+    # the scroll was answered from the capture of the last step
+    assert processor.page_cache[env.page.client] is capture  # type: ignore
+    assert capture.reused
+
+    # and matches a fresh capture of the scrolled page
+    processor.page_cache.clear()
+    processor.observation_memo = None
+    assert env._get_obs()["text"] == obs["text"]
+    assert not processor.page_cache[env.page.client].reused  # type: ignore
+
+
 def test_multiple_start_url(script_browser_env: ScriptBrowserEnv) -> None:
     temp_config = tempfile.NamedTemporaryFile("w", delete=False)
     config = {
@@ -308,3 +421,214 @@ def test_accessibility_tree_observation_update(
         )
     )
     assert "UNIQUE_NAME" in obs["text"]
+
+
+def test_incremental_accessibility_tree(
+    incremental_accessibility_tree_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = incremental_accessibility_tree_script_browser_env
+    env.reset()
+    obs, *_ = env.step(
+        create_playwright_action(
+            "page.goto('https://russmaxdesign.github.io/exercise/')"
+        )
+    )
+    processor = env.observation_handler.text_processor
+    tracker = processor.accessibility_trackers[env.get_page_client(env.page)]
+    num_nodes = tracker.num_fetched_nodes
+    obs, *_ = env.step(
+        create_playwright_action(
+            'page.get_by_label("Full name").fill("UNIQUE_NAME")'
+        )
+    )
+    assert "UNIQUE_NAME" in obs["text"]
+    assert tracker.num_fetched_nodes < num_nodes
+
+    # the patched tree matches a full fetch of the same page, the page did
+    # not change so the memo has to go for the tree to be fetched again
+    processor.incremental_accessibility_tree = False
+    processor.observation_memo = None
+    assert env._get_obs()["text"] == obs["text"]
+
+
+def test_page_script_accessibility_tree(
+    page_script_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = page_script_script_browser_env
+    env.reset()
+    obs, success, _, _, info = env.step(
+        create_playwright_action(
+            'page.goto("https://russmaxdesign.github.io/exercise/")'
+        )
+    )
+    assert success
+    assert "combobox 'Favourite mammal'" in obs["text"]
+    assert "gridcell 'Canyon bat'" not in obs["text"]
+
+    obs, *_ = env.step(
+        create_playwright_action(
+            'page.get_by_label("Full name").fill("UNIQUE_NAME")'
+        )
+    )
+    assert "UNIQUE_NAME" in obs["text"]
+
+    # the element ids can be used by the id based actions
+    element_id = re.search(r"\[(\d+)\] textbox 'Full name'", obs["text"])
+    assert element_id is not None
+    obs, success, *_ = env.step(
+        create_id_based_action(f"click [{element_id.group(1)}]")
+    )
+    assert success
+
+
+def test_unchanged_page_reuses_observation(
+    accessibility_tree_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = accessibility_tree_script_browser_env
+    env.reset()
+    obs, *_ = env.step(
+        create_playwright_action(
+            'page.goto("https://russmaxdesign.github.io/exercise/")'
+        )
+    )
+    # an element id that does not exist leaves the page untouched
+    new_obs, success, *_ = env.step(create_id_based_action("click [999999]"))
+    assert not success
+    assert new_obs["text"] == obs["text"]
+    memo = env.observation_handler.text_processor.observation_memo
+    assert memo is not None and memo.hits == 1
+
+
+def test_late_image_load_is_observed(
+    accessibility_tree_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = accessibility_tree_script_browser_env
+    env.reset()
+    images: list[Route] = []
+
+    def handle(route: Route) -> None:
+        if route.request.resource_type == "image":
+            images.append(route)  # answered later
+        else:
+            route.fulfill(
+                content_type="text/html",
+                body="<img src='/late.png'><button>Below</button>",
+            )
+
+    env.context.route("http://example.test/**", handle)
+    env.page.goto("http://example.test/", wait_until="domcontentloaded")
+    while not images:
+        env.page.wait_for_timeout(50)
+
+    processor = env.observation_handler.text_processor
+
+    def button_bound() -> list[float]:
+        for info in processor.obs_nodes_info.values():
+            if "button 'Below'" in info["text"]:
+                return info["union_bound"]
+        raise AssertionError("button not shown")
+
+    env.step(create_id_based_action("click [999999]"))
+    bound = button_bound()
+
+    # an image without explicit dimensions moves the button down
+    png = BytesIO()
+    Image.new("RGB", (10, 300)).save(png, format="PNG")
+    images[0].fulfill(content_type="image/png", body=png.getvalue())
+    env.page.wait_for_load_state("load")
+
+    # the next no-op step is not answered from the memo
+    env.step(create_id_based_action("click [999999]"))
+    memo = processor.observation_memo
+    assert memo is not None and memo.hits == 0
+    assert button_bound()[1] >= bound[1] + 300
+
+
+def test_lazy_page_content(script_browser_env: ScriptBrowserEnv) -> None:
+    env = script_browser_env
+    env.reset()
+    _, _, _, _, info = env.step(
+        create_goto_url_action("http://www.example.com")
+    )
+    assert "Example Domain" in info["page"].content
+    _, _, _, _, next_info = env.step(
+        create_goto_url_action("https://www.rfc-editor.org/rfc/rfc2606.html")
+    )
+    # read before the next step, it still describes the example page
+    assert "Example Domain" in info["page"].content
+    env.step(create_goto_url_action("http://www.example.com"))
+    with pytest.raises(RuntimeError):
+        next_info["page"].content
+
+
+def test_resource_blocking(
+    resource_blocking_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = resource_blocking_script_browser_env
+    env.reset()
+    obs, success, *_ = env.step(
+        create_playwright_action(
+            'page.goto("https://russmaxdesign.github.io/exercise/")'
+        )
+    )
+    assert success and "RootWebArea" in obs["text"]
+    # images are stubbed with a blank pixel, the stylesheets still apply
+    sizes = env.page.evaluate(
+        "[...document.images].map(img => img.naturalWidth)"
+    )
+    assert all(size <= 1 for size in sizes)
+    assert env.page.evaluate("document.styleSheets.length") > 0
+
+
+def test_extra_text_observations(
+    extra_text_observations_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = extra_text_observations_script_browser_env
+    env.reset()
+    obs, *_ = env.step(
+        create_playwright_action(
+            'page.goto("https://russmaxdesign.github.io/exercise/")'
+        )
+    )
+    assert "RootWebArea" in obs["text"]
+    assert "<html" in obs["html"] and "RootWebArea" not in obs["html"]
+    assert set(env.observation_space.keys()) == {"text", "image", "html"}
+
+
+def test_browser_is_kept_across_resets(
+    script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = script_browser_env
+    env.reset()
+    browser = env.browser
+    env.step(create_goto_url_action("http://www.example.com"))
+    env.context.add_cookies(
+        [{"name": "task", "value": "1", "url": "http://www.example.com"}]
+    )
+    env.reset()
+    # a new context for the new task in the same browser
+    assert env.browser is browser and browser is not None
+    assert len(browser.contexts) == 1 and env.context.cookies() == []
+
+
+def test_prefetched_contexts() -> None:
+    config_files = []
+    for url in ["http://www.example.com", "https://www.rfc-editor.org"]:
+        temp_config = tempfile.NamedTemporaryFile("w", delete=False)
+        json.dump({"start_url": url}, temp_config)
+        temp_config.close()
+        config_files.append(temp_config.name)
+
+    env = ScriptBrowserEnv(prefetch_contexts=2)
+    env.reset(options={"config_file": config_files[0]})
+    env.prefetch(config_files[0])
+    env.prefetch(config_files[1])
+    assert len(env.prefetched) == 2
+    prefetched = env.prefetched[str(Path(config_files[1]).resolve())]
+
+    # the run skipped the first task, its context is stale
+    env.reset(options={"config_file": config_files[1]})
+    assert env.context is prefetched.context and not env.prefetched
+    assert env.page.url == "https://www.rfc-editor.org/"
+    assert env.browser is not None and len(env.browser.contexts) == 1
+    env.close()